@@ -0,0 +1,367 @@
+"""PoetryMaster pratik yollarının çevrimdışı ölçümleri.
+
+Ağ ya da mikrofon gerektirmez: seslendirme sabit bir MP3 üreten taklitle, ses tanıma
+StubBackend ile, mikrofon ise sentetik av.AudioFrame akışıyla değiştirilir.
+
+    python benchmarks/bench_practice.py                      # sonuçları yazdır ve kaydet
+    python benchmarks/bench_practice.py --compare OLD.json   # önceki bir ölçümle karşılaştır
+    python benchmarks/bench_practice.py --only similarity    # yalnızca adı eşleşenler
+
+Sonuçlar varsayılan olarak benchmarks/results/<commit>.json dosyasına yazılır.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "siirezberlemecloud.py")
+WORKDIR = tempfile.mkdtemp(prefix="poetrymaster-bench-")
+
+# Uygulama içe aktarılmadan önce: depolar geçici dizine, tanıma taklit arka uca
+os.environ.setdefault("POETRY_CORPUS_DB", os.path.join(WORKDIR, "corpus.db"))
+os.environ.setdefault("POETRY_STATE_DB", os.path.join(WORKDIR, "state.db"))
+os.environ.setdefault("TTS_CACHE_DIR", os.path.join(WORKDIR, "tts"))
+os.environ["RECOGNITION_BACKEND"] = "stub"
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import av  # noqa: E402
+
+import siirezberlemecloud as app  # noqa: E402
+
+REGRESSION_RATIO = 1.2
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return register
+
+
+def measure(fn, repeat=7, number=None, budget=0.2):
+    # number verilmezse bir turun yaklaşık `budget` saniye sürmesi için ayarlanır
+    if number is None:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            if time.perf_counter() - start >= budget / 4 or number >= 1 << 20:
+                break
+            number *= 2
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number)
+    return {
+        "median_us": statistics.median(runs) * 1e6,
+        "min_us": min(runs) * 1e6,
+        "max_us": max(runs) * 1e6,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+# --- Veri ---
+def poem_lines():
+    corpus = app.get_corpus()
+    lines = []
+    for title in corpus.titles():
+        lines.extend(app.load_poem(title)["content"])
+    return lines
+
+
+def mishear(line, rng):
+    # Tanıma hatalarını taklit et: bir kelimeyi düşür ve bir harfi değiştir
+    words = line.split()
+    if len(words) > 3:
+        del words[rng.randrange(len(words))]
+    i = rng.randrange(len(words))
+    word = words[i]
+    if len(word) > 2:
+        j = rng.randrange(len(word))
+        words[i] = word[:j] + rng.choice("aeıioöuü") + word[j + 1:]
+    return " ".join(words)
+
+
+# --- Metin işleme ---
+@benchmark("clean_text/line")
+def bench_clean_text():
+    lines = poem_lines()
+    return measure(lambda: [app.clean_text(line) for line in lines[:32]])
+
+
+def score(original, spoken):
+    # Uygulamanın puanlama yolu: normalleştirilmiş metinler üzerinde düzenleme benzerliği
+    return app.sequence_similarity(app.clean_text(original), app.clean_text(spoken))
+
+
+@benchmark("sequence_similarity/line")
+def bench_similarity_line():
+    rng = random.Random(1)
+    pairs = [(line, mishear(line, rng)) for line in poem_lines()[:32]]
+    return measure(lambda: [score(original, spoken) for original, spoken in pairs])
+
+
+@benchmark("sequence_similarity/stanza")
+def bench_similarity_stanza():
+    rng = random.Random(2)
+    lines = poem_lines()
+    stanzas = [" ".join(lines[i:i + app.GROUP_SIZE]) for i in range(0, len(lines) - app.GROUP_SIZE, app.GROUP_SIZE)][:8]
+    pairs = [(stanza, mishear(stanza, rng)) for stanza in stanzas]
+    return measure(lambda: [score(original, spoken) for original, spoken in pairs])
+
+
+@benchmark("poem_index/similarity")
+def bench_index_similarity():
+    rng = random.Random(3)
+    title = app.get_corpus().titles()[0]
+    index = app.get_poem_index(title)
+    spoken = [mishear(line, rng) for line in index.lines]
+    return measure(lambda: [index.similarity(i, text, 0.75) for i, text in enumerate(spoken)])
+
+
+@benchmark("scramble_indices/line")
+def bench_scramble_indices():
+    rng = random.Random(4)
+    sizes = [len(line.split()) for line in poem_lines()[:32]]
+    return measure(lambda: [app.scramble_indices(size, rng) for size in sizes])
+
+
+@benchmark("poem_exercises/build")
+def bench_poem_exercises():
+    title = app.get_corpus().titles()[0]
+    index = app.get_poem_index(title)
+    return measure(lambda: app.PoemExercises(title, index))
+
+
+# --- Seslendirme ---
+def fake_mp3(seconds=2.0, rate=24000):
+    out = io.BytesIO()
+    with av.open(out, "w", format="mp3") as container:
+        stream = container.add_stream("mp3", rate=rate)
+        stream.layout = "mono"
+        t = np.arange(int(seconds * rate)) / rate
+        pcm = (np.sin(2 * np.pi * 220 * t) * 0.3).astype(np.float32)
+        frame_size = 1152
+        for start in range(0, pcm.size, frame_size):
+            chunk = pcm[start:start + frame_size]
+            frame = av.AudioFrame.from_ndarray(chunk.reshape(1, -1), format="flt", layout="mono")
+            frame.sample_rate = rate
+            frame.pts = start
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+def stub_synthesizer():
+    audio = fake_mp3()
+    calls = []
+
+    def synthesize_speech(text, lang='tr'):
+        calls.append(text)
+        return audio
+
+    app.synthesize_speech = synthesize_speech
+    return calls
+
+
+@benchmark("text_to_speech/miss")
+def bench_tts_miss():
+    stub_synthesizer()
+    counter = iter(range(1 << 30))
+    return measure(lambda: app.text_to_speech(f"satır {next(counter)}"), repeat=5)
+
+
+@benchmark("text_to_speech/hit")
+def bench_tts_hit():
+    stub_synthesizer()
+    app.text_to_speech("Korkma, sönmez bu şafaklarda yüzen al sancak;")
+    return measure(lambda: app.text_to_speech("Korkma, sönmez bu şafaklarda yüzen al sancak;"))
+
+
+@benchmark("text_to_speech/slow_hit")
+def bench_tts_slow():
+    stub_synthesizer()
+    app.text_to_speech("Sönmeden yurdumun üstünde tüten en son ocak.", slow=True)
+    return measure(lambda: app.text_to_speech("Sönmeden yurdumun üstünde tüten en son ocak.", slow=True))
+
+
+# --- Kayıt → tanıma ---
+def synthetic_frames(seconds=4.0, rate=app.CAPTURE_SAMPLE_RATE, samples_per_frame=960, seed=5, layout="mono"):
+    # Tarayıcıdan gelen 20 ms'lik s16 çerçeveler: sessizlik, iki konuşma parçası, sessizlik.
+    # layout="stereo" aiortc'nin Opus çözücüsünün verdiği paketli (1, 2 * örnek) biçimidir.
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    envelope = ((t > 0.5) & (t < 1.8)) | ((t > 2.4) & (t < 3.5))
+    voiced = np.sin(2 * np.pi * 180 * t) + 0.5 * np.sin(2 * np.pi * 360 * t)
+    signal = voiced * envelope * 8000 + rng.normal(0, 30, t.size)
+    pcm = np.clip(signal, -32768, 32767).astype(np.int16)
+    channels = 2 if layout == "stereo" else 1
+    frames = []
+    for start in range(0, pcm.size - samples_per_frame + 1, samples_per_frame):
+        chunk = np.repeat(pcm[start:start + samples_per_frame], channels)
+        frame = av.AudioFrame.from_ndarray(chunk.reshape(1, -1), format="s16", layout=layout)
+        frame.sample_rate = rate
+        frames.append(frame)
+    return frames
+
+
+def record_and_recognize(frames, buffer, service):
+    # record_audio ile aynı adımlar; webrtc bileşeni yerine çerçeveler doğrudan verilir
+    for frame in frames:
+        buffer.write(app.frame_to_mono(frame), frame.sample_rate)
+    samples, rate = buffer.take()
+    segments = app.detect_speech(samples, rate)
+    pcm = app.resample_audio(app.join_segments(samples, segments, rate), rate)
+    job_id = service.submit(app.flac_audio_data(pcm))
+    while True:
+        status, result = service.poll(job_id)
+        if status != "pending":
+            return status, result
+        time.sleep(0.001)
+
+
+@benchmark("record_recognize/utterance")
+def bench_record_recognize():
+    frames = synthetic_frames()
+    buffer = app.AudioRingBuffer(app.MAX_UTTERANCE_SECONDS * app.CAPTURE_SAMPLE_RATE)
+    service = app.RecognitionService(app.StubBackend(default="korkma sönmez bu şafaklarda"))
+    status, _ = record_and_recognize(frames, buffer, service)
+    assert status == "done", status
+    return measure(lambda: record_and_recognize(frames, buffer, service), repeat=5)
+
+
+@benchmark("record_recognize/stereo_s16")
+def bench_stereo_frames():
+    # Gerçek mikrofon yolu: paketli stereo s16 tek kanala inerken genlik korunmalı
+    mono = synthetic_frames()
+    stereo = synthetic_frames(layout="stereo")
+    for a, b in zip(mono, stereo):
+        converted = app.frame_to_mono(b)
+        assert converted.dtype == np.int16 and converted.size == a.samples
+        assert np.array_equal(converted, app.frame_to_mono(a)), "stereo s16 dönüşümü bozuk"
+    return measure(lambda: [app.frame_to_mono(frame) for frame in stereo])
+
+
+@benchmark("record_recognize/flac_encode")
+def bench_flac_encode():
+    pcm = (np.sin(np.arange(3 * app.RECOGNIZER_SAMPLE_RATE) * 0.07) * 8000).astype(np.int16)
+    return measure(lambda: app.flac_audio_data(pcm).get_flac_data(convert_width=2))
+
+
+# --- Tam yeniden çalıştırma (AppTest) ---
+def install_fake_webrtc(frames):
+    # webrtc bileşeni gerçek bir Streamlit sunucusu ister. Uygulama streamlit_webrtc'yi ilk
+    # kullanımda içe aktardığı için yerine, her çağrıda bir kaydı çerçeve çerçeve
+    # audio_frame_callback'e verip durmuş bir bağlam döndüren bir modül koyuyoruz.
+    fake = types.ModuleType("streamlit_webrtc")
+    fake.WebRtcMode = types.SimpleNamespace(SENDONLY="sendonly")
+
+    def webrtc_streamer(key, audio_frame_callback=None, **kwargs):
+        for frame in frames:
+            audio_frame_callback(frame)
+        return types.SimpleNamespace(state=types.SimpleNamespace(playing=False))
+
+    fake.webrtc_streamer = webrtc_streamer
+    sys.modules["streamlit_webrtc"] = fake
+
+
+def app_rerun(mode):
+    from streamlit.testing.v1 import AppTest
+
+    install_fake_webrtc(synthetic_frames(layout="stereo"))
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state["audio_enabled"] = False
+    at.session_state["streaming_mode"] = False
+    at.run()
+    assert not at.exception, at.exception
+    at.session_state["line_index"] = app.GROUP_SIZE
+    at.session_state["current_mode"] = mode
+
+    def rerun():
+        at.run()
+        assert not at.exception, at.exception
+        assert at.session_state["current_mode"] == mode
+
+    rerun()
+    return measure(rerun, repeat=5, number=3)
+
+
+for _mode in ("show", "test", "word_sort", "group_test"):
+    benchmark(f"rerun/{_mode}")(lambda _mode=_mode: app_rerun(_mode))
+
+
+# --- Kayıt ve karşılaştırma ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"\nKarşılaştırma: {baseline_path}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["median_us"] / baseline[name]["median_us"]
+        flag = "  <-- yavaşladı" if ratio > REGRESSION_RATIO else ""
+        print(f"  {name:32s} {ratio:6.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", help="yalnızca adında bu metin geçen ölçümler")
+    parser.add_argument("--output", help="sonuç dosyası (varsayılan: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="karşılaştırılacak önceki sonuç dosyası")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = {}
+    for name, fn in BENCHMARKS:
+        if args.only and args.only not in name:
+            continue
+        results[name] = fn()
+        print(f"{name:32s} {results[name]['median_us']:12.1f} µs")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nSonuçlar: {output}")
+
+    if args.compare and compare(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,257 @@
+import time
+_SCRIPT_START = time.perf_counter()
 import streamlit as st
-import tempfile
-import speech_recognition as sr
-from difflib import SequenceMatcher
+import streamlit.components.v1 as components
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import importlib
+import bisect
 import re
+import unicodedata
+import math
+import json
+import sqlite3
 import os
-from gtts import gTTS
+import sys
+import tempfile
+import uuid
+import hashlib
+import hmac
+import heapq
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, closing, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    from rapidfuzz.distance import Levenshtein as rapid_levenshtein
+except ImportError:  # saf Python bit-paralel yedeğe düşülür
+    rapid_levenshtein = None
+import base64
 import io
-from PIL import Image
-import time
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, deque
 import random
-from streamlit_webrtc import webrtc_streamer, WebRtcMode
-import av
 from typing import Union
-from scipy.io.wavfile import write
+_EAGER_IMPORT_SECONDS = time.perf_counter() - _SCRIPT_START
+
+
+# --- Gecikmeli İçe Aktarma ---
+# Streamlit betiği her etkileşimde yeniden çalıştırır ve oturumların çoğu mikrofonu,
+# seslendirmeyi ya da ağır sinyal işleme kütüphanelerini hiç kullanmaz. Bu modüller
+# ilk öznitelik erişiminde yüklenir; yükleme süreleri get_import_times()'a yazılır.
+IMPORT_REPORT = os.environ.get("POETRY_IMPORT_REPORT", "") not in ("", "0")
+
+
+@st.cache_resource
+def get_import_times():
+    # Süreler süreç boyunca saklanır: betik her yeniden çalıştırmada modül düzeyini baştan kurar,
+    # fakat modüller sys.modules'ta kaldığından gerçek yükleme süreçte yalnızca bir kez olur.
+    # İlk çağrı modül düzeyinde yapılır; başlangıç içe aktarmaları o çalıştırmanın süresidir.
+    return {"(başlangıç içe aktarmaları)": _EAGER_IMPORT_SECONDS}
+
+
+get_import_times()
+
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            cold = self._name not in sys.modules
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            if cold:
+                elapsed = time.perf_counter() - start
+                get_import_times().setdefault(self._name, elapsed)
+                if IMPORT_REPORT:
+                    logging.getLogger("poetrymaster").info("%s yüklendi: %.1f ms", self._name, elapsed * 1000)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+sr = lazy_import("speech_recognition")
+gtts = lazy_import("gtts")
+requests = lazy_import("requests")
+urllib3 = lazy_import("urllib3")
+Image = lazy_import("PIL.Image")
+av = lazy_import("av")
+webrtc = lazy_import("streamlit_webrtc")
+sf = lazy_import("soundfile")
+scipy_signal = lazy_import("scipy.signal")
+wavfile = lazy_import("scipy.io.wavfile")
+
+
+def import_report():
+    loaded = sorted(get_import_times().items(), key=lambda item: -item[1])
+    lines = [f"{name}: {seconds * 1000:.1f} ms" for name, seconds in loaded]
+    lines.append(f"betik başlangıcı → şimdi: {(time.perf_counter() - _SCRIPT_START) * 1000:.1f} ms")
+    return lines
+
+
+# --- Ölçümler ---
+# POETRY_METRICS=prometheus: POETRY_METRICS_PORT üzerinde /metrics uç noktası açılır.
+# POETRY_METRICS=json: her yeniden çalıştırma için aşamaların süreleri tek bir JSON satırı
+# olarak loglanır. Kapalıyken span() paylaşılan boş bir bağlam döndürür, inc/observe hemen döner.
+METRICS_MODE = os.environ.get("POETRY_METRICS", "").lower()
+METRICS_PORT = int(os.environ.get("POETRY_METRICS_PORT", 9464))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+metrics_logger = logging.getLogger("poetrymaster.metrics")
+_NO_SPAN = nullcontext()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    def __init__(self, mode=METRICS_MODE):
+        self.mode = mode
+        self.enabled = mode in ("prometheus", "json")
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._trace = threading.local()
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += amount
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # [kova sayıları (+Inf dahil), toplam, adet]
+                histogram = self._histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def span(self, name, **labels):
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name, labels)
+
+    def trace(self, **labels):
+        # Bir yeniden çalıştırmanın tamamı; içindeki span'ler json modunda tek kayıtta toplanır
+        if not self.enabled:
+            return _NO_SPAN
+        return self._traced_rerun(labels)
+
+    @contextmanager
+    def _span(self, name, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("poetry_stage_seconds", elapsed, stage=name, **labels)
+            if self.mode == "json":
+                record = {"span": name, "ms": round(elapsed * 1000, 3), **labels}
+                spans = getattr(self._trace, "spans", None)
+                if spans is not None:
+                    spans.append(record)
+                else:
+                    metrics_logger.info(json.dumps({"event": "span", **record}, ensure_ascii=False))
+
+    @contextmanager
+    def _traced_rerun(self, labels):
+        self.inc("poetry_reruns_total", **labels)
+        self._trace.spans = [] if self.mode == "json" else None
+        try:
+            with self._span("rerun", labels):
+                yield
+        finally:
+            spans, self._trace.spans = self._trace.spans, None
+            if spans is not None:
+                metrics_logger.info(json.dumps({"event": "rerun", **labels, "spans": spans}, ensure_ascii=False))
+
+    def render_prometheus(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self._histograms.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, cumulative in zip(LATENCY_BUCKETS + ("+Inf",), itertools.accumulate(counts)):
+                bound = bound if isinstance(bound, str) else f"{bound:g}"
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    metrics = Metrics()
+    if metrics.mode == "prometheus":
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), MetricsHandler)
+        except OSError:
+            metrics_logger.exception("Ölçüm uç noktası %s portunda açılamadı", METRICS_PORT)
+        else:
+            server.metrics = metrics
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return metrics
+
+
+METRICS = get_metrics()
 
 
 # --- Theme ve Genel Görünüm Ayarları ---
@@ -120,7 +357,8 @@ def set_ui_theme():
     """, unsafe_allow_html=True)
 
 
-set_ui_theme()
+with METRICS.span("set_ui_theme"):
+    set_ui_theme()
 
 # --- Şiir Verisi ---
 siirler = {
@@ -168,30 +406,1316 @@ siirler = {
 
 
 # --- Yardımcı Fonksiyonlar ---
-@st.cache_data(ttl=3600)
+# str.lower() Türkçe I/İ harflerini yanlış küçültür; şapkalı harfler de düz karşılıklarına indirilir
+TURKISH_FOLD = str.maketrans({"I": "ı", "İ": "i", "Â": "a", "â": "a", "Î": "i", "î": "i", "Û": "u", "û": "u"})
+PUNCTUATION = re.compile(r'[^\w\s]')
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
 def clean_text(text):
-    return re.sub(r'[^\w\s]', '', text.lower())
+    text = unicodedata.normalize("NFC", text).translate(TURKISH_FOLD).lower()
+    return " ".join(PUNCTUATION.sub('', text).split())
+
+
+def _strip_common_affix(a, b):
+    # Ezberden okumada metnin çoğu doğrudur: ortak önek ve sonek mesafeyi değiştirmez. Dilim
+    # karşılaştırması C'de yapıldığı için sınır ikili aramayla bulunur.
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    a, b = a[lo:], b[lo:]
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return a[:len(a) - lo], b[:len(b) - lo]
+
+
+def levenshtein(a, b):
+    # Karakter dizileri ve kelime listeleri için düzenleme mesafesi. rapidfuzz kuruluysa onun
+    # C++ uygulaması, değilse Myers/Hyyrö bit-paralel algoritması kullanılır.
+    a, b = _strip_common_affix(a, b)
+    if rapid_levenshtein is not None:
+        return rapid_levenshtein.distance(a, b)
+    if len(a) < len(b):
+        a, b = b, a
+    m = len(b)
+    if m == 0:
+        return len(a)
+
+    peq = {}
+    for i, symbol in enumerate(b):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for symbol in a:
+        eq = peq.get(symbol, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
+
+
+def prefix_distance(target, spoken):
+    # min_k levenshtein(target[:k], spoken): konuşmanın hedefin herhangi bir önekine olan en küçük mesafesi
+    m = len(spoken)
+    if m == 0:
+        return 0
+    peq = {}
+    for i, symbol in enumerate(spoken):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    best = score
+    for symbol in target:
+        eq = peq.get(symbol, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        best = min(best, score)
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return best
+
+
+def sequence_similarity(a, b):
+    longest = max(len(a), len(b))
+    return 1.0 - levenshtein(a, b) / longest if longest else 1.0
+
+
+def similarity_upper_bound(orig, user):
+    # Konuşma devam ederse ulaşılabilecek en yüksek benzerlik: söylenenin hedefe en yakın
+    # önekle eşleştiği ve kalan kısmın hatasız söyleneceği varsayılır.
+    # Girdiler clean_text ile normalleştirilmiş olmalıdır.
+    if not orig:
+        return 0.0
+    distance = prefix_distance(orig, user)
+    if len(user) > len(orig) + distance:
+        return 1.0 - (len(user) - len(orig)) / len(user)
+    return 1.0 - distance / (len(orig) + distance)
+
+
+def align_words(reference, spoken):
+    # Kelime düzeyinde hizalama. Satırlar numpy ile hesaplanır: yatay (ekleme) bağımlılığı
+    # birikimli minimum ile çözülür. Sonuç (işlem, referans_indeksi, konuşma_indeksi) listesidir.
+    n, m = len(reference), len(spoken)
+    vocabulary = {}
+    ref_ids = np.array([vocabulary.setdefault(w, len(vocabulary)) for w in reference], dtype=np.int64)
+    spoken_ids = np.array([vocabulary.setdefault(w, len(vocabulary)) for w in spoken], dtype=np.int64)
+
+    offsets = np.arange(m + 1)
+    table = np.zeros((n + 1, m + 1), dtype=np.int64)
+    table[0] = offsets
+    for i in range(1, n + 1):
+        candidates = np.empty(m + 1, dtype=np.int64)
+        candidates[0] = i
+        candidates[1:] = np.minimum(table[i - 1, 1:] + 1, table[i - 1, :-1] + (spoken_ids != ref_ids[i - 1]))
+        table[i] = np.minimum.accumulate(candidates - offsets) + offsets
+
+    ops = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and table[i, j] == table[i - 1, j - 1] + (ref_ids[i - 1] != spoken_ids[j - 1]):
+            ops.append(("match" if ref_ids[i - 1] == spoken_ids[j - 1] else "sub", i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif i > 0 and table[i, j] == table[i - 1, j] + 1:
+            ops.append(("del", i - 1, None))
+            i -= 1
+        else:
+            ops.append(("ins", None, j - 1))
+            j -= 1
+    ops.reverse()
+    return ops
+
+
+def locate_words(reference, spoken):
+    # Yarı-global hizalama: referansın tamamı konuşmanın herhangi bir bölümüyle eşleştirilir.
+    # (mesafe, başlangıç, bitiş) döner; başlangıç/bitiş konuşmadaki kelime indeksleridir.
+    n, m = len(reference), len(spoken)
+    if n == 0:
+        return 0, 0, 0
+    vocabulary = {}
+    ref_ids = np.array([vocabulary.setdefault(w, len(vocabulary)) for w in reference], dtype=np.int64)
+    spoken_ids = np.array([vocabulary.setdefault(w, len(vocabulary)) for w in spoken], dtype=np.int64)
+
+    offsets = np.arange(m + 1)
+    table = np.zeros((n + 1, m + 1), dtype=np.int64)
+    for i in range(1, n + 1):
+        candidates = np.empty(m + 1, dtype=np.int64)
+        candidates[0] = i
+        candidates[1:] = np.minimum(table[i - 1, 1:] + 1, table[i - 1, :-1] + (spoken_ids != ref_ids[i - 1]))
+        table[i] = np.minimum.accumulate(candidates - offsets) + offsets
+
+    end = int(np.argmin(table[n]))
+    i, j = n, end
+    while i > 0:
+        if j > 0 and table[i, j] == table[i - 1, j - 1] + (ref_ids[i - 1] != spoken_ids[j - 1]):
+            i, j = i - 1, j - 1
+        elif table[i, j] == table[i - 1, j] + 1:
+            i -= 1
+        else:
+            j -= 1
+    return int(table[n, end]), j, end
+
+
+def highlight_line(original, spoken):
+    words = original.split()
+    normalized = [clean_text(word) for word in words]
+    positions = [i for i, word in enumerate(normalized) if word]
+    status = {}
+    for op, ref_index, _ in align_words([normalized[i] for i in positions], clean_text(spoken).split()):
+        if ref_index is not None:
+            status[positions[ref_index]] = op
+
+    styles = {
+        "sub": "background-color: #fff3cd; border-bottom: 2px solid #f0ad4e;",
+        "del": "background-color: #ffcdd2; text-decoration: underline wavy var(--error-color);",
+    }
+    return " ".join(
+        f'<span style="{styles[status[i]]} border-radius: 4px; padding: 0 0.2rem;">{word}</span>'
+        if status.get(i) in styles else word
+        for i, word in enumerate(words)
+    )
 
 
-def check_similarity(original, spoken, threshold=0.75):
-    orig = clean_text(original)
-    user = clean_text(spoken)
-    similarity = SequenceMatcher(None, orig, user).ratio()
-    return similarity, similarity >= threshold
+# --- Şiir Deposu ---
+CORPUS_DB_PATH = os.environ.get("POETRY_CORPUS_DB", os.path.join(tempfile.gettempdir(), "poetrymaster-corpus.db"))
+CORPUS_IMPORT_PATH = os.environ.get("POETRY_CORPUS_PATH")
+CORPUS_MMAP_BYTES = 256 * 1024 * 1024
+POEM_SEARCH_LIMIT = 20
+CORPUS_VERSION = 2
+FREE_QUERY_NGRAMS = 24
+FREE_POSTING_LIMIT = 200
+FREE_CANDIDATE_LIMIT = 20
+
+CORPUS_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE poems (
+    id INTEGER PRIMARY KEY,
+    title TEXT UNIQUE NOT NULL,
+    title_key TEXT NOT NULL,
+    author TEXT,
+    difficulty TEXT,
+    bg_color TEXT,
+    line_count INTEGER NOT NULL
+);
+CREATE INDEX poems_title_key ON poems (title_key);
+CREATE TABLE lines (
+    poem_id INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (poem_id, line_no)
+) WITHOUT ROWID;
+CREATE TABLE title_trigrams (
+    trigram TEXT NOT NULL,
+    poem_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, poem_id)
+) WITHOUT ROWID;
+CREATE TABLE line_ngrams (
+    ngram TEXT NOT NULL,
+    poem_id INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    PRIMARY KEY (ngram, poem_id, line_no)
+) WITHOUT ROWID;
+CREATE TABLE ngram_df (ngram TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+"""
+
+
+def text_trigrams(text):
+    trigrams = set()
+    for word in text.split():
+        padded = f" {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def line_ngrams(text):
+    # Kelime ve ardışık kelime çifti n-gramları; tanıma hatalarında bile bir kısmı eşleşir
+    words = text.split()
+    ngrams = {f"w:{word}" for word in words}
+    ngrams.update(f"b:{a} {b}" for a, b in zip(words, words[1:]))
+    return ngrams
+
+
+def iter_corpus_sources():
+    # Koddaki şiirler her zaman yüklenir; müfredat şiirleri JSON Lines dosyasından eklenir
+    # (her satır: title, author, difficulty, bg_color, content).
+    for title, poem in siirler.items():
+        yield title, poem
+    if CORPUS_IMPORT_PATH:
+        with open(CORPUS_IMPORT_PATH, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    poem = json.loads(line)
+                    yield poem["title"], poem
+
+
+def corpus_fingerprint():
+    digest = hashlib.sha256(f"v{CORPUS_VERSION}".encode("utf-8"))
+    digest.update(json.dumps(siirler, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    if CORPUS_IMPORT_PATH and os.path.exists(CORPUS_IMPORT_PATH):
+        stat = os.stat(CORPUS_IMPORT_PATH)
+        digest.update(f"{CORPUS_IMPORT_PATH}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_corpus(path, fingerprint):
+    # Veritabanı geçici bir dosyada kurulur ve atomik olarak yerine taşınır; böylece aynı anda
+    # başlayan süreçler yarım kalmış bir veritabanı görmez.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    os.close(fd)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        with conn:
+            conn.executescript(CORPUS_SCHEMA)
+            conn.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+            for title, poem in iter_corpus_sources():
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO poems (title, title_key, author, difficulty, bg_color, line_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (title, clean_text(title), poem.get("author", ""), poem.get("difficulty", "Belirtilmemiş"),
+                     poem.get("bg_color", "#f5f5f5"), len(poem["content"]))
+                )
+                if not cursor.rowcount:
+                    continue
+                poem_id = cursor.lastrowid
+                conn.executemany("INSERT INTO lines VALUES (?, ?, ?)",
+                                 ((poem_id, i, line) for i, line in enumerate(poem["content"])))
+                conn.executemany("INSERT OR IGNORE INTO title_trigrams VALUES (?, ?)",
+                                 ((trigram, poem_id) for trigram in
+                                  text_trigrams(clean_text(f"{title} {poem.get('author', '')}"))))
+                conn.executemany("INSERT OR IGNORE INTO line_ngrams VALUES (?, ?, ?)",
+                                 ((ngram, poem_id, i) for i, line in enumerate(poem["content"])
+                                  for ngram in line_ngrams(clean_text(line))))
+            conn.execute("INSERT INTO ngram_df SELECT ngram, COUNT(*) FROM line_ngrams GROUP BY ngram")
+            conn.execute("INSERT INTO meta SELECT 'line_count', COUNT(*) FROM lines")
+        conn.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class PoemCorpus:
+    # Şiir metadata'sı ve satırları SQLite'ta tutulur; satırlar yalnızca şiir açıldığında okunur.
+    # Dosya mmap ile eşlendiği için okumalar işletim sisteminin sayfa önbelleğinden karşılanır.
+    def __init__(self, path=CORPUS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        fingerprint = corpus_fingerprint()
+        if self._stored_fingerprint() != fingerprint:
+            build_corpus(path, fingerprint)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={CORPUS_MMAP_BYTES}")
+            self._local.conn = conn
+        return conn
+
+    def _stored_fingerprint(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)) as conn:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+
+    def titles(self, limit=POEM_SEARCH_LIMIT):
+        rows = self._connection().execute("SELECT title FROM poems ORDER BY id LIMIT ?", (limit,))
+        return [title for title, in rows]
+
+    def metadata(self, title):
+        row = self._connection().execute(
+            "SELECT id, author, difficulty, bg_color, line_count FROM poems WHERE title = ?", (title,)
+        ).fetchone()
+        if row is None:
+            return None
+        poem_id, author, difficulty, bg_color, line_count = row
+        return {"id": poem_id, "title": title, "author": author, "difficulty": difficulty,
+                "bg_color": bg_color, "line_count": line_count}
+
+    def lines(self, poem_id):
+        rows = self._connection().execute("SELECT text FROM lines WHERE poem_id = ? ORDER BY line_no", (poem_id,))
+        return [text for text, in rows]
+
+    def search(self, query, limit=POEM_SEARCH_LIMIT):
+        key = clean_text(query)
+        if not key:
+            return self.titles(limit)
+        conn = self._connection()
+        if len(key) < 3:
+            rows = conn.execute(
+                "SELECT title FROM poems WHERE title_key LIKE ? ESCAPE '\\' ORDER BY title LIMIT ?",
+                (key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%", limit)
+            )
+            return [title for title, in rows]
+
+        trigrams = sorted(text_trigrams(key))
+        rows = conn.execute(
+            "SELECT p.title FROM title_trigrams t JOIN poems p ON p.id = t.poem_id "
+            f"WHERE t.trigram IN ({', '.join('?' * len(trigrams))}) "
+            "GROUP BY t.poem_id HAVING COUNT(*) * 2 >= ? ORDER BY COUNT(*) DESC, p.title LIMIT ?",
+            (*trigrams, len(trigrams), limit)
+        )
+        return [title for title, in rows]
+
+    def candidate_lines(self, text, poem_id=None, limit=FREE_CANDIDATE_LIMIT):
+        # Ters indeks sorgusu: yalnızca en nadir FREE_QUERY_NGRAMS n-gram ve her birinden en fazla
+        # FREE_POSTING_LIMIT kayıt okunur; maliyet külliyat büyüdükçe sabit kalır.
+        ngrams = sorted(line_ngrams(clean_text(text)))
+        if not ngrams:
+            return []
+        conn = self._connection()
+        frequencies = []
+        for start in range(0, len(ngrams), 500):
+            batch = ngrams[start:start + 500]
+            frequencies.extend(conn.execute(
+                f"SELECT ngram, df FROM ngram_df WHERE ngram IN ({', '.join('?' * len(batch))})", batch
+            ))
+        frequencies.sort(key=lambda row: row[1])
+        total = int(conn.execute("SELECT value FROM meta WHERE key = 'line_count'").fetchone()[0])
+
+        scores = defaultdict(float)
+        query = "SELECT poem_id, line_no FROM line_ngrams WHERE ngram = ?"
+        if poem_id is not None:
+            query += " AND poem_id = ?"
+        for ngram, df in frequencies[:FREE_QUERY_NGRAMS]:
+            weight = math.log(1 + total / df) * (2 if ngram.startswith("b:") else 1)
+            params = (ngram, poem_id, FREE_POSTING_LIMIT) if poem_id is not None else (ngram, FREE_POSTING_LIMIT)
+            for key in conn.execute(query + " LIMIT ?", params):
+                scores[key] += weight
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    def line_details(self, keys):
+        conn = self._connection()
+        return [conn.execute("SELECT p.title, l.text FROM lines l JOIN poems p ON p.id = l.poem_id "
+                             "WHERE l.poem_id = ? AND l.line_no = ?", key).fetchone() for key in keys]
+
+
+def locate_spoken_lines(spoken_text, poem_id=None, threshold=0.75):
+    # Aday satırlar ters indeksten gelir, ardından her biri metin içinde hassas olarak konumlandırılır
+    corpus = get_corpus()
+    spoken = clean_text(spoken_text).split()
+    keys = corpus.candidate_lines(spoken_text, poem_id)
+    found = []
+    for (poem, line_no), (title, text) in zip(keys, corpus.line_details(keys)):
+        tokens = clean_text(text).split()
+        if not tokens:
+            continue
+        distance, start, end = locate_words(tokens, spoken)
+        score = max(0.0, 1.0 - distance / len(tokens))
+        if score >= threshold:
+            found.append({"poem_id": poem, "title": title, "line": line_no, "text": text,
+                          "score": score, "start": start, "end": end})
+
+    # Aynı konuşma bölümüne düşen adaylardan yalnızca en iyisini tut
+    accepted = []
+    for candidate in sorted(found, key=lambda c: -c["score"]):
+        span = max(1, candidate["end"] - candidate["start"])
+        if all(min(candidate["end"], other["end"]) - max(candidate["start"], other["start"]) < span / 2
+               for other in accepted):
+            accepted.append(candidate)
+    return sorted(accepted, key=lambda c: c["start"])
+
+
+@st.cache_resource
+def get_corpus():
+    return PoemCorpus()
+
+
+@st.cache_resource(max_entries=256)
+def load_poem(title):
+    corpus = get_corpus()
+    poem = corpus.metadata(title)
+    poem["content"] = corpus.lines(poem["id"])
+    return poem
+
+
+# --- Şiir İndeksi ---
+class PoemIndex:
+    # Şiir yüklendiğinde bir kez kurulur: her satırın normalleştirilmiş metni ve kelime
+    # kimlikleri satır ofsetleriyle düz dizilerde tutulur.
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.normalized = [clean_text(line) for line in self.lines]
+        self.display_tokens = [TOKEN_PATTERN.findall(line) for line in self.lines]
+
+        self.vocabulary = {}
+        token_ids, token_offsets = [], [0]
+        for text in self.normalized:
+            token_ids.extend(self.vocabulary.setdefault(token, len(self.vocabulary)) for token in text.split())
+            token_offsets.append(len(token_ids))
+
+        self.words = list(self.vocabulary)
+        self.token_ids = np.array(token_ids, dtype=np.int32)
+        self.token_offsets = np.array(token_offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def line_token_ids(self, i):
+        return self.token_ids[self.token_offsets[i]:self.token_offsets[i + 1]]
+
+    def tokens(self, i):
+        return [self.words[token_id] for token_id in self.line_token_ids(i)]
+
+    def similarity(self, i, spoken, threshold=0.75):
+        similarity = sequence_similarity(self.normalized[i], clean_text(spoken))
+        return similarity, similarity >= threshold
+
+
+GROUP_SIZE = 4
+GROUP_SKIP_THRESHOLD = 0.4
+
+
+def align_group(index, line_numbers, spoken_text):
+    # Tek kayıttaki metni grup satırlarıyla eşleştirir: her satır için puan, atlanma ve
+    # önceki satırdan önce okunup okunmadığı (sıra hatası) belirlenir. Satırlar ortak
+    # kelimeleri paylaşamaz: her turda en iyi eşleşen satır kendi aralığını sahiplenir,
+    # kalan satırlar yalnızca boşta kalan aralıklarda aranır.
+    spoken = clean_text(spoken_text).split()
+    tokens = {line_no: index.tokens(line_no) for line_no in line_numbers}
+    scores = {line_no: 1.0 if not tokens[line_no] else 0.0 for line_no in line_numbers}
+    spans = {}
+    pending = [line_no for line_no in line_numbers if tokens[line_no]]
+    claimed = []
+    while pending:
+        gaps, position = [], 0
+        for claim_start, claim_end in sorted(claimed):
+            gaps.append((position, claim_start))
+            position = claim_end
+        gaps.append((position, len(spoken)))
+
+        best = None
+        for line_no in pending:
+            scores[line_no] = 0.0
+            for gap_start, gap_end in gaps:
+                if gap_end <= gap_start:
+                    continue
+                distance, start, end = locate_words(tokens[line_no], spoken[gap_start:gap_end])
+                score = max(0.0, 1.0 - distance / len(tokens[line_no]))
+                if score > scores[line_no]:
+                    scores[line_no] = score
+                    if best is None or score > best[0]:
+                        best = (score, line_no, gap_start + start, gap_start + end)
+        if best is None or best[0] < GROUP_SKIP_THRESHOLD:
+            break
+        _, line_no, start, end = best
+        spans[line_no] = start
+        claimed.append((start, end))
+        pending.remove(line_no)
+
+    results = []
+    last_start = -1
+    for line_no in line_numbers:
+        start = spans.get(line_no)
+        skipped = scores[line_no] < GROUP_SKIP_THRESHOLD
+        out_of_order = start is not None and start < last_start
+        if start is not None and not out_of_order:
+            last_start = start
+        results.append({"line": line_no, "score": scores[line_no], "start": start,
+                        "skipped": skipped, "out_of_order": out_of_order})
+    return results
+
+
+@st.cache_resource
+def get_poem_index(title):
+    return PoemIndex(load_poem(title)["content"])
+
+
+# --- Kalıcı Durum Deposu ---
+STATE_DB_PATH = os.environ.get("POETRY_STATE_DB", os.path.join(tempfile.gettempdir(), "poetrymaster-state.db"))
+STATE_POOL_SIZE = 4
+STATE_FLUSH_INTERVAL = 1.0
+STATE_BATCH_SIZE = 500
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    user_id TEXT NOT NULL,
+    poem TEXT NOT NULL,
+    line_index INTEGER NOT NULL,
+    completed_lines TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (user_id, poem)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS line_scores (
+    user_id TEXT NOT NULL,
+    poem TEXT NOT NULL,
+    line_no INTEGER NOT NULL,
+    score REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (user_id, poem, line_no)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS review_state (
+    user_id TEXT NOT NULL,
+    poem TEXT NOT NULL,
+    line_no INTEGER NOT NULL,
+    repetitions INTEGER NOT NULL,
+    interval REAL NOT NULL,
+    ease REAL NOT NULL,
+    due REAL NOT NULL,
+    PRIMARY KEY (user_id, poem, line_no)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS attempts (
+    user_id TEXT NOT NULL,
+    poem TEXT NOT NULL,
+    line_no INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    score REAL NOT NULL,
+    latency REAL NOT NULL,
+    ts REAL NOT NULL
+);
+"""
+logger = logging.getLogger("poetrymaster")
+
+
+class ConnectionPool:
+    def __init__(self, path, size=STATE_POOL_SIZE):
+        self._pool = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._pool.put(conn)
+        with self.connection() as conn:
+            conn.executescript(STATE_SCHEMA)
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+
+class StateStore:
+    # Yazmalar kuyruğa alınır ve arka planda tek işlemde (transaction) toplu olarak yazılır;
+    # betik çalışması hiçbir zaman veritabanı yazmasını beklemez.
+    def __init__(self, path=STATE_DB_PATH):
+        self.pool = ConnectionPool(path)
+        self._events = queue.Queue()
+        self._drain_lock = threading.Lock()
+        threading.Thread(target=self._run, name="state-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def enqueue(self, sql, params):
+        self._events.put((sql, params))
+
+    def _drain(self):
+        with self._drain_lock:
+            written = 0
+            while True:
+                batch = []
+                try:
+                    while len(batch) < STATE_BATCH_SIZE:
+                        batch.append(self._events.get_nowait())
+                except queue.Empty:
+                    pass
+                if not batch:
+                    return written
+                with self.pool.connection() as conn, conn:
+                    for sql, events in itertools.groupby(batch, key=lambda event: event[0]):
+                        conn.executemany(sql, [params for _, params in events])
+                written += len(batch)
+
+    def _run(self):
+        while True:
+            time.sleep(STATE_FLUSH_INTERVAL)
+            try:
+                self._drain()
+            except sqlite3.Error:
+                logger.exception("İlerleme kayıtları yazılamadı")
+
+    def flush(self):
+        return self._drain()
+
+    def load_progress(self, user, poem):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT line_index, completed_lines FROM progress WHERE user_id = ? AND poem = ?",
+                               (user, poem)).fetchone()
+        if row is None:
+            return 0, []
+        return row[0], json.loads(row[1])
+
+    def load_scores(self, user, poem):
+        with self.pool.connection() as conn:
+            return dict(conn.execute("SELECT line_no, score FROM line_scores WHERE user_id = ? AND poem = ?",
+                                     (user, poem)))
+
+    def save_position(self, user, poem, line_index, completed_lines):
+        self.enqueue("INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?)",
+                     (user, poem, line_index, json.dumps(completed_lines), time.time()))
+
+    def save_score(self, user, poem, line_no, score):
+        self.enqueue("INSERT OR REPLACE INTO line_scores VALUES (?, ?, ?, ?, ?)",
+                     (user, poem, line_no, score, time.time()))
+
+    def save_attempt(self, user, poem, line_no, mode, score, latency, ts):
+        self.enqueue("INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (user, poem, line_no, mode, score, latency, ts))
+
+    def reset_progress(self, user, poem):
+        # Silme beklemeden yazılır: hemen ardından gelen load_progress eski satırları okumamalı
+        self.enqueue("DELETE FROM progress WHERE user_id = ? AND poem = ?", (user, poem))
+        self.enqueue("DELETE FROM line_scores WHERE user_id = ? AND poem = ?", (user, poem))
+        self.flush()
+
+
+@st.cache_resource
+def get_state_store():
+    return StateStore()
+
+
+def hydrate_progress():
+    # Şiir ilk açıldığında (ya da değiştirildiğinde) ilerlemeyi depodan yükle
+    poem = st.session_state.selected_poem
+    previous = st.session_state.get('loaded_poem')
+    if previous == poem:
+        return
 
+    cache = st.session_state.setdefault('poem_progress', {})
+    if previous is not None:
+        cache[previous] = (st.session_state.line_index, st.session_state.completed_lines)
+        clear_mode_state()
+    if poem in cache:
+        line_index, completed_lines = cache[poem]
+    else:
+        line_index, completed_lines = get_state_store().load_progress(st.session_state.user_id, poem)
+
+    st.session_state.line_index = line_index
+    st.session_state.completed_lines = completed_lines
+    st.session_state.loaded_poem = poem
+    st.session_state.review_line = None
+    st.session_state.saved_position = (line_index, len(completed_lines))
+
+
+def clear_mode_state():
+    # Alıştırma durumu bir şiire aittir; şiir değişince süren işler iptal edilir ve gösterime dönülür
+    for key in ('recognition_job', 'group_job', 'free_job'):
+        job_id = st.session_state.get(key)
+        if job_id is not None:
+            get_recognition_service().cancel(job_id)
+        st.session_state[key] = None
+    st.session_state.group_result = None
+    reset_recitation_stream()
+    st.session_state.current_mode = "show"
+
+
+def persist_progress():
+    # Konum değişiklikleri her çalıştırmada değil, yalnızca değiştiklerinde kuyruğa alınır
+    poem = st.session_state.get('loaded_poem')
+    snapshot = (st.session_state.line_index, len(st.session_state.completed_lines))
+    if poem is None or st.session_state.get('saved_position') == snapshot:
+        return
+    get_state_store().save_position(st.session_state.user_id, poem, st.session_state.line_index,
+                                    st.session_state.completed_lines)
+    st.session_state.saved_position = snapshot
+
+
+def reset_session():
+    poem = st.session_state.get('loaded_poem')
+    if poem is not None:
+        get_state_store().reset_progress(st.session_state.user_id, poem)
+        get_score_stats().reset(st.session_state.user_id, poem)
+    st.session_state.clear()
+    init_session()
+
+
+# --- Tekrar Planlayıcı ---
+# "20 dakika sonra ve 1 gün sonra tekrar yapın" önerisi ilk iki öğrenme adımıdır
+REVIEW_LEARNING_STEPS = [20 * 60, 24 * 3600]
+REVIEW_RETRY_DELAY = 60
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+
+def review_grade(score):
+    for grade, minimum in ((5, 0.95), (4, 0.85), (3, 0.75), (2, 0.5), (1, 0.01)):
+        if score >= minimum:
+            return grade
+    return 0
+
+
+def sm2_update(state, grade, now):
+    # SM-2: (tekrar sayısı, aralık [sn], kolaylık, sonraki tarih)
+    repetitions, interval, ease = state[:3]
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if grade < 3:
+        return 0, 0.0, ease, now + REVIEW_RETRY_DELAY
+    if repetitions < len(REVIEW_LEARNING_STEPS):
+        interval = float(REVIEW_LEARNING_STEPS[repetitions])
+    else:
+        interval = interval * ease
+    return repetitions + 1, interval, ease, now + interval
+
+
+class ReviewScheduler:
+    # Her kullanıcı için satır durumları ve tarihe göre sıralı bir heap tutulur. Güncellenen
+    # satırın eski heap girdisi silinmez, en üste çıktığında atlanır.
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self._states = {}
+        self._heaps = {}
+
+    def _load(self, user):
+        if user not in self._states:
+            with self._store.pool.connection() as conn:
+                rows = conn.execute(
+                    "SELECT poem, line_no, repetitions, interval, ease, due FROM review_state WHERE user_id = ?",
+                    (user,)
+                ).fetchall()
+            states = {(poem, line): tuple(state) for poem, line, *state in rows}
+            heap = [(state[3], poem, line) for (poem, line), state in states.items()]
+            heapq.heapify(heap)
+            self._states[user] = states
+            self._heaps[user] = heap
+        return self._states[user], self._heaps[user]
+
+    def _top(self, user):
+        states, heap = self._load(user)
+        while heap and states[(heap[0][1], heap[0][2])][3] != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def review(self, user, poem, line, score, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            states, heap = self._load(user)
+            state = sm2_update(states.get((poem, line), (0, 0.0, DEFAULT_EASE, now)), review_grade(score), now)
+            states[(poem, line)] = state
+            heapq.heappush(heap, (state[3], poem, line))
+            if len(heap) > 2 * len(states):
+                heap[:] = [(due, poem, line) for (poem, line), (_, _, _, due) in states.items()]
+                heapq.heapify(heap)
+            self._persist(user, poem, line, state)
+        return state
+
+    def _persist(self, user, poem, line, state):
+        self._store.enqueue("INSERT OR REPLACE INTO review_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (user, poem, line, *state))
+
+    def next_review(self, user):
+        with self._lock:
+            return self._top(user)
+
+
+@st.cache_resource
+def get_scheduler():
+    return ReviewScheduler(get_state_store())
+
+
+def record_score(line_no, score):
+    now = time.time()
+    user, poem, mode = st.session_state.user_id, st.session_state.selected_poem, st.session_state.current_mode
+    latency = now - st.session_state.get('mode_started', now)
+    get_state_store().save_score(user, poem, line_no, score)
+    get_state_store().save_attempt(user, poem, line_no, mode, score, latency, now)
+    get_score_stats().record(user, poem, line_no, mode, score, latency, now)
+    get_scheduler().review(user, poem, line_no, score)
+
+
+def start_review(poem, line_no):
+    persist_progress()
+    st.session_state.selected_poem = poem
+    st.session_state.poem_selector = poem
+    hydrate_progress()
+    # Kayıtlı konum (line_index) değişmez; test modu tekrar satırını review_line'dan okur
+    st.session_state.review_line = line_no
+    st.session_state.recognition_job = None
+    reset_recitation_stream()
+    st.session_state.current_mode = "test"
+
+
+# --- Skor İstatistikleri ---
+ATTEMPT_MODES = ("test", "word_sort", "group_test", "free")
+SCORE_BINS = 10
+ROLLING_WINDOW = 20
+HARD_LINE_MIN_ATTEMPTS = 3
+
+
+class RunningStats:
+    # Welford ortalama/varyans, son ROLLING_WINDOW denemenin kayan ortalaması ve skor histogramı;
+    # her ekleme O(1).
+    __slots__ = ("count", "mean", "m2", "window", "window_sum", "histogram")
+
+    def __init__(self, window=ROLLING_WINDOW):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.window = deque(maxlen=window)
+        self.window_sum = 0.0
+        self.histogram = [0] * SCORE_BINS
+
+    @classmethod
+    def from_scores(cls, scores, window=ROLLING_WINDOW):
+        stats = cls(window)
+        if scores.size:
+            stats.count = int(scores.size)
+            stats.mean = float(scores.mean())
+            stats.m2 = float(((scores - stats.mean) ** 2).sum())
+            stats.window.extend(float(score) for score in scores[-window:])
+            stats.window_sum = sum(stats.window)
+            stats.histogram = np.bincount(score_bins(scores), minlength=SCORE_BINS).tolist()
+        return stats
+
+    def add(self, score):
+        self.count += 1
+        delta = score - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (score - self.mean)
+        if len(self.window) == self.window.maxlen:
+            self.window_sum -= self.window[0]
+        self.window.append(score)
+        self.window_sum += score
+        self.histogram[int(score_bins(score))] += 1
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def recent_mean(self):
+        return self.window_sum / len(self.window) if self.window else 0.0
+
+
+def score_bins(scores):
+    return np.clip((np.asarray(scores) * SCORE_BINS).astype(np.int64), 0, SCORE_BINS - 1)
+
+
+class LatestScores:
+    # Bir kullanıcının bir şiirdeki satır başına son skoru: ortalama ve en iyi satır O(1) okunur.
+    # En iyi satırın skoru düştüğünde yalnızca o şiirin satırları yeniden taranır.
+    def __init__(self, scores=None):
+        self.scores = dict(scores or {})
+        self.total = sum(self.scores.values())
+        self.best = max(self.scores.items(), key=lambda item: item[1], default=None)
+
+    def set(self, line_no, score):
+        self.total += score - self.scores.get(line_no, 0.0)
+        self.scores[line_no] = score
+        if self.best is None or score >= self.best[1]:
+            self.best = (line_no, score)
+        elif self.best[0] == line_no:
+            self.best = max(self.scores.items(), key=lambda item: item[1])
+
+    @property
+    def mean(self):
+        return self.total / len(self.scores) if self.scores else 0.0
+
+
+class AttemptLog:
+    # Denemeler sütun düzeninde, büyüyebilen numpy dizilerinde tutulur; kullanıcı ve şiir adları
+    # tamsayı kodlara çevrilir. Sınıf geneli sorgular bu diziler üzerinde vektörel çalışır.
+    COLUMNS = (("user", np.int32), ("poem", np.int32), ("line", np.int32), ("mode", np.int8),
+               ("score", np.float32), ("latency", np.float32), ("ts", np.float64))
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS}
+        self.users, self.user_codes = [], {}
+        self.poems, self.poem_codes = [], {}
+
+    @staticmethod
+    def _code(value, names, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def user_code(self, user):
+        return self._code(user, self.users, self.user_codes)
+
+    def poem_code(self, poem):
+        return self._code(poem, self.poems, self.poem_codes)
+
+    def _reserve(self, count):
+        capacity = len(self.columns["ts"])
+        if self.size + count <= capacity:
+            return
+        while capacity < self.size + count:
+            capacity *= 2
+        # Eski diziler yerinde değiştirilmez; view() ile alınmış dilimler geçerli kalır
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def append(self, user, poem, line_no, mode, score, latency, ts):
+        self._reserve(1)
+        row = (self.user_code(user), self.poem_code(poem), line_no, ATTEMPT_MODES.index(mode), score, latency, ts)
+        for (name, _), value in zip(self.COLUMNS, row):
+            self.columns[name][self.size] = value
+        self.size += 1
+
+    def extend(self, rows):
+        if not rows:
+            return
+        users, poems, lines, modes, scores, latencies, ts = zip(*rows)
+        mode_codes = {mode: code for code, mode in enumerate(ATTEMPT_MODES)}
+        values = ([self.user_code(user) for user in users], [self.poem_code(poem) for poem in poems], lines,
+                  [mode_codes[mode] for mode in modes], scores, latencies, ts)
+        self._reserve(len(rows))
+        for (name, _), column in zip(self.COLUMNS, values):
+            self.columns[name][self.size:self.size + len(rows)] = column
+        self.size += len(rows)
+
+    def view(self, name):
+        return self.columns[name][:self.size]
+
+
+class ScoreStats:
+    # Her deneme hem olay günlüğüne eklenir hem de satır, şiir ve kullanıcı düzeyindeki
+    # RunningStats'lara işlenir. Bir anahtarın istatistikleri ilk istendiğinde günlükten
+    # (vektörel olarak) oluşturulur, sonrasında yalnızca artımlı güncellenir.
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._latest = {}
+        self.log = AttemptLog()
+        with store.pool.connection() as conn:
+            cursor = conn.execute("SELECT user_id, poem, line_no, mode, score, latency, ts FROM attempts ORDER BY ts")
+            while True:
+                rows = cursor.fetchmany(100000)
+                if not rows:
+                    break
+                self.log.extend(rows)
+
+    def _mask(self, key):
+        kind, *values = key
+        log = self.log
+        if kind == "line":
+            poem, line_no = values
+            return (log.view("poem") == log.poem_code(poem)) & (log.view("line") == line_no)
+        if kind == "poem":
+            return log.view("poem") == log.poem_code(values[0])
+        if kind == "user":
+            return log.view("user") == log.user_code(values[0])
+        user, poem = values
+        return (log.view("user") == log.user_code(user)) & (log.view("poem") == log.poem_code(poem))
+
+    def _get(self, key):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = RunningStats.from_scores(self.log.view("score")[self._mask(key)])
+        return stats
+
+    def record(self, user, poem, line_no, mode, score, latency, ts):
+        keys = (("line", poem, line_no), ("poem", poem), ("user", user), ("user_poem", user, poem))
+        with self._lock:
+            self.log.append(user, poem, line_no, mode, score, latency, ts)
+            for key in keys:
+                stats = self._stats.get(key)
+                if stats is not None:
+                    stats.add(score)
+            latest = self._latest.get((user, poem))
+            if latest is not None:
+                latest.set(line_no, score)
+
+    def stats(self, *key):
+        with self._lock:
+            return self._get(key)
+
+    def latest(self, user, poem):
+        with self._lock:
+            latest = self._latest.get((user, poem))
+        if latest is None:
+            latest = LatestScores(self._store.load_scores(user, poem))
+            with self._lock:
+                latest = self._latest.setdefault((user, poem), latest)
+        return latest
+
+    def reset(self, user, poem):
+        # Deneme geçmişi sınıf istatistikleri için saklanır; yalnızca güncel skorlar sıfırlanır
+        with self._lock:
+            self._latest[(user, poem)] = LatestScores()
+
+    def _select(self, names, poem=None, since=None):
+        # Günlüğe yalnızca ekleme yapıldığından kilit altında alınan dilimler kopyalanmadan okunabilir
+        with self._lock:
+            log = self.log
+            columns = {name: log.view(name) for name in set(names) | {"poem", "ts"}}
+            poem_code = log.poem_codes.get(poem, -1)
+            user_count = len(log.users)
+        mask = None
+        if poem is not None:
+            mask = columns["poem"] == poem_code
+        if since is not None:
+            recent = columns["ts"] >= since
+            mask = recent if mask is None else mask & recent
+        rows = {name: columns[name] if mask is None else columns[name][mask] for name in names}
+        return rows, user_count
+
+    def summary(self, poem=None, since=None):
+        rows, user_count = self._select(("user", "score"), poem, since)
+        scores = rows["score"]
+        return {
+            "attempts": int(scores.size),
+            "users": int(np.count_nonzero(np.bincount(rows["user"], minlength=user_count))),
+            "mean": float(scores.mean()) if scores.size else 0.0,
+            "histogram": np.bincount(score_bins(scores), minlength=SCORE_BINS).tolist(),
+        }
 
-def record_audio():
+    def hardest_lines(self, poem, since=None, limit=10, min_attempts=HARD_LINE_MIN_ATTEMPTS):
+        rows, _ = self._select(("line", "score", "latency"), poem, since)
+        lines = rows["line"]
+        if not lines.size:
+            return []
+        scores = rows["score"].astype(np.float64)
+        counts = np.bincount(lines)
+        sums = np.bincount(lines, weights=scores)
+        squares = np.bincount(lines, weights=scores ** 2)
+        failed = np.bincount(lines, weights=(scores < 0.75).astype(np.float64))
+        latency = np.bincount(lines, weights=rows["latency"])
+
+        candidates = np.flatnonzero(counts >= min_attempts)
+        means = sums[candidates] / counts[candidates]
+        order = candidates[np.argsort(means, kind="stable")][:limit]
+        return [{
+            "line": int(line),
+            "attempts": int(counts[line]),
+            "mean": float(sums[line] / counts[line]),
+            "std": math.sqrt(max(0.0, squares[line] / counts[line] - (sums[line] / counts[line]) ** 2)),
+            "fail_rate": float(failed[line] / counts[line]),
+            "latency": float(latency[line] / counts[line]),
+        } for line in order]
+
+    def by_mode(self, poem=None, since=None):
+        rows, _ = self._select(("mode", "score", "latency"), poem, since)
+        modes = rows["mode"].astype(np.int64)
+        counts = np.bincount(modes, minlength=len(ATTEMPT_MODES))
+        sums = np.bincount(modes, weights=rows["score"], minlength=len(ATTEMPT_MODES))
+        latency = np.bincount(modes, weights=rows["latency"], minlength=len(ATTEMPT_MODES))
+        return [{"mode": mode, "attempts": int(count), "mean": float(total / count), "latency": float(seconds / count)}
+                for mode, count, total, seconds in zip(ATTEMPT_MODES, counts, sums, latency) if count]
+
+
+@st.cache_resource
+def get_score_stats():
+    return ScoreStats(get_state_store())
+
+
+# --- Ses Yakalama ---
+RECOGNIZER_SAMPLE_RATE = 16000
+CAPTURE_SAMPLE_RATE = 48000
+MAX_UTTERANCE_SECONDS = 30
+
+
+class AudioRingBuffer:
+    # WebRTC iş parçacığından gelen örnekleri önceden ayrılmış bir dairesel tamponda tutar.
+    # Tampon dolduğunda yeni örnekler reddedilir (geri basınç) ve sayılır.
+    def __init__(self, capacity):
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self._lock = threading.Lock()
+        self._tail = 0
+        self._size = 0
+        self.sample_rate = None
+        self.dropped = 0
+
+    @property
+    def capacity(self):
+        return self._data.size
+
+    @property
+    def size(self):
+        return self._size
+
+    def write(self, samples, sample_rate):
+        with self._lock:
+            if self.sample_rate is None:
+                self.sample_rate = sample_rate
+            capacity = self._data.size
+            n = min(capacity - self._size, samples.size)
+            if n:
+                head = (self._tail + self._size) % capacity
+                first = min(n, capacity - head)
+                self._data[head:head + first] = samples[:first]
+                self._data[:n - first] = samples[first:n]
+                self._size += n
+            self.dropped += samples.size - n
+            return n
+
+    def read(self, max_samples=None):
+        with self._lock:
+            n = self._size if max_samples is None else min(max_samples, self._size)
+            capacity = self._data.size
+            first = min(n, capacity - self._tail)
+            out = np.empty(n, dtype=np.int16)
+            out[:first] = self._data[self._tail:self._tail + first]
+            out[first:] = self._data[:n - first]
+            self._tail = (self._tail + n) % capacity
+            self._size -= n
+            return out
+
+    def reset(self):
+        with self._lock:
+            self._tail = 0
+            self._size = 0
+            self.sample_rate = None
+            self.dropped = 0
+
+    def take(self):
+        rate = self.sample_rate or CAPTURE_SAMPLE_RATE
+        samples = self.read()
+        self.reset()
+        return samples, rate
+
+
+def frame_to_mono(frame):
+    # aiortc'nin Opus çözücüsü paketli stereo s16 verir: (1, 2 * örnek) biçiminde, kanallar iç içe.
+    # Kanal ortalaması tamsayıyı float'a çevirdiği için ölçekleme kaynak türüne göre yapılır.
+    samples = frame.to_ndarray()
+    kind, itemsize = samples.dtype.kind, samples.dtype.itemsize
+    channels = len(frame.layout.channels)
+    if frame.format.is_planar:
+        samples = samples.mean(axis=0) if channels > 1 else samples.reshape(-1)
+    else:
+        samples = samples.reshape(-1, channels).mean(axis=1) if channels > 1 else samples.reshape(-1)
+    if kind == "f":
+        samples = np.clip(samples, -1.0, 1.0) * 32767
+    elif itemsize > 2:
+        samples = samples / (1 << (8 * (itemsize - 2)))
+    return samples.astype(np.int16, copy=False)
+
+
+def resample_audio(samples, src_rate, dst_rate=RECOGNIZER_SAMPLE_RATE):
+    if src_rate == dst_rate:
+        return samples
+    g = math.gcd(src_rate, dst_rate)
+    resampled = scipy_signal.resample_poly(samples.astype(np.float32), dst_rate // g, src_rate // g)
+    return np.clip(resampled, -32768, 32767).astype(np.int16)
+
+
+# --- Konuşma Algılama (VAD) ---
+VAD_FRAME_MS = 20
+VAD_MIN_ENERGY_DB = 40
+# Gürültü tabanı bu değeri aşamaz: baştan sona konuşma içeren bir parçada alt yüzdelik
+# de konuşmadır ve tavan olmasa parçanın tamamı gürültü sayılırdı
+VAD_MAX_NOISE_FLOOR_DB = 55
+VAD_ENERGY_MARGIN_DB = 10
+VAD_ZCR_THRESHOLD = 0.25
+VAD_HANGOVER_FRAMES = 8
+VAD_PREROLL_FRAMES = 3
+VAD_MIN_SPEECH_FRAMES = 5
+VAD_SPLIT_SILENCE_SECONDS = 0.6
+VAD_JOIN_SILENCE_SECONDS = 0.25
+
+
+def _extend_active(active, frames):
+    # Her aktif çerçeveden sonraki `frames` çerçeveyi de aktif say (hangover)
+    positions = np.arange(active.size)
+    last_active = np.maximum.accumulate(np.where(active, positions, -frames - 1))
+    return (positions - last_active) <= frames
+
+
+def _frame_energy(samples, rate):
+    frame = int(rate * VAD_FRAME_MS / 1000)
+    n = samples.size // frame
+    frames = samples[:n * frame].astype(np.float32).reshape(n, frame)
+    return frame, frames, 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-9)
+
+
+def speech_noise_floor(samples, rate, energy_db=None):
+    # Çerçeve enerjilerinin 10. yüzdeliği, VAD_MAX_NOISE_FLOOR_DB ile sınırlanır
+    if energy_db is None:
+        energy_db = _frame_energy(samples, rate)[2]
+    if energy_db.size == 0:
+        return None
+    return min(float(np.percentile(energy_db, 10)), VAD_MAX_NOISE_FLOOR_DB)
+
+
+def detect_speech(samples, rate, split_seconds=VAD_SPLIT_SILENCE_SECONDS, hangover=VAD_HANGOVER_FRAMES,
+                  noise_floor=None):
+    # noise_floor: parça parça işlenen bir kayıtta önceki parçalardan taşınan taban tahmini
+    frame, frames, energy_db = _frame_energy(samples, rate)
+    if energy_db.size == 0:
+        return []
+    signs = np.signbit(frames)
+    zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+    floor = speech_noise_floor(samples, rate, energy_db)
+    noise_floor = floor if noise_floor is None else min(noise_floor, floor)
+    loud = energy_db > max(noise_floor + VAD_ENERGY_MARGIN_DB, VAD_MIN_ENERGY_DB)
+    # Ötümsüz ünsüzler (s, ş, f) düşük enerjili ama sıfır geçişi yüksektir
+    fricative = (zcr > VAD_ZCR_THRESHOLD) & (energy_db > max(noise_floor + VAD_ENERGY_MARGIN_DB / 2,
+                                                             VAD_MIN_ENERGY_DB - VAD_ENERGY_MARGIN_DB / 2))
+    active = loud | fricative
+    if not active.any():
+        return []
+    active = _extend_active(active, hangover) | _extend_active(active[::-1], VAD_PREROLL_FRAMES)[::-1]
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+
+    # Uzun duraklamalarla ayrılmamış parçaları birleştir
+    split = (starts[1:] - ends[:-1]) * VAD_FRAME_MS / 1000 >= split_seconds
+    starts = starts[np.concatenate(([True], split))]
+    ends = ends[np.concatenate((split, [True]))]
+
+    keep = (ends - starts) >= VAD_MIN_SPEECH_FRAMES
+    return [(int(start) * frame, int(end) * frame) for start, end in zip(starts[keep], ends[keep])]
+
+
+def join_segments(samples, segments, rate):
+    gap = np.zeros(int(rate * VAD_JOIN_SILENCE_SECONDS), dtype=samples.dtype)
+    parts = []
+    for start, end in segments:
+        if parts:
+            parts.append(gap)
+        parts.append(samples[start:end])
+    return np.concatenate(parts) if parts else samples[:0]
+
+
+def get_capture_buffer():
+    if 'capture_buffer' not in st.session_state:
+        st.session_state.capture_buffer = AudioRingBuffer(MAX_UTTERANCE_SECONDS * CAPTURE_SAMPLE_RATE)
+    return st.session_state.capture_buffer
+
+
+def start_capture(sink):
+    # sink: write(samples, sample_rate) sunan herhangi bir alıcı (tampon ya da canlı değerlendirme)
     st.warning("Lütfen mikrofon erişimine izin verin")
-    audio_data = None
 
     def audio_frame_callback(frame: av.AudioFrame) -> av.AudioFrame:
-        nonlocal audio_data
-        audio_data = frame.to_ndarray()
+        sink.write(frame_to_mono(frame), frame.sample_rate)
         return frame
 
-    ctx = webrtc_streamer(
+    return webrtc.webrtc_streamer(
         key="poetry-recorder",
-        mode=WebRtcMode.SENDONLY,
+        mode=webrtc.WebRtcMode.SENDONLY,
         audio_frame_callback=audio_frame_callback,
         media_stream_constraints={
             "audio": {
@@ -205,19 +1729,812 @@ def record_audio():
         }
     )
 
-    if ctx.state.playing and audio_data is not None:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            write(tmp_file.name, 44100, audio_data)
-            return tmp_file.name
-    return None
+
+def record_audio():
+    buffer = get_capture_buffer()
+    ctx = start_capture(buffer)
+
+    if ctx.state.playing:
+        if buffer.dropped:
+            st.warning(f"Maksimum kayıt süresine ({MAX_UTTERANCE_SECONDS} sn) ulaşıldı. Lütfen kaydı durdurun.")
+        else:
+            st.info("🎙️ Kayıt yapılıyor... Bitirdiğinizde kaydı durdurun.")
+        return None
+
+    if buffer.size == 0:
+        return None
+
+    samples, rate = buffer.take()
+    segments = detect_speech(samples, rate)
+    if not segments:
+        st.warning("🔇 Konuşma algılanmadı. Lütfen mikrofona yakın konuşarak tekrar deneyin.")
+        return None
+
+    pcm = resample_audio(join_segments(samples, segments, rate), rate)
+    return flac_audio_data(pcm)
+
+
+@st.cache_resource
+def flac_audio_class():
+    # speech_recognition FLAC'ı her çağrıda harici `flac` sürecini başlatarak üretir.
+    # 16 kHz mono int16 kayıtları libsndfile ile bellekte kodlayıp sonucu saklıyoruz;
+    # başka bir hız/genişlik istenirse kütüphanenin kendi yoluna düşülür.
+    # Sınıf, speech_recognition yalnızca ses tanıma kullanıldığında yüklensin diye burada tanımlanır.
+    class FlacAudioData(sr.AudioData):
+        def get_flac_data(self, convert_rate=None, convert_width=None):
+            if convert_rate not in (None, self.sample_rate) or convert_width not in (None, 2) or self.sample_width != 2:
+                return super().get_flac_data(convert_rate, convert_width)
+            if getattr(self, "_flac", None) is None:
+                pcm = np.frombuffer(self.frame_data, dtype=np.int16)
+                out = io.BytesIO()
+                sf.write(out, pcm, self.sample_rate, format="FLAC", subtype="PCM_16")
+                self._flac = out.getvalue()
+            return self._flac
+
+    return FlacAudioData
+
+
+def flac_audio_data(pcm, rate=RECOGNIZER_SAMPLE_RATE):
+    return flac_audio_class()(np.ascontiguousarray(pcm, dtype=np.int16).tobytes(), rate, 2)
+
+
+# --- Paylaşılan İstemciler ---
+HTTP_POOL_SIZE = 16
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.3
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, 15)
+GOOGLE_SPEECH_PREFIX = "https://www.google.com/speech-api/"
+GOOGLE_SPEECH_URL = GOOGLE_SPEECH_PREFIX + "v2/recognize"
+# Anahtar yalnızca ortamdan okunur; tanımlı değilse Google arka ucu kapalıdır
+GOOGLE_SPEECH_KEY = os.environ.get("GOOGLE_SPEECH_KEY", "")
+# Paylaşılan oturumla gönderim kütüphanelerin iç ayrıntılarına (gTTS._prepare_requests, yanıt
+# biçimleri) dayanır; yalnızca denenmiş sürümlerde kullanılır, diğerlerinde genel API'ye düşülür.
+POOLED_SPEECH_RECOGNITION_VERSIONS = ("3.10.",)
+POOLED_GTTS_VERSIONS = ("2.5.",)
+
+
+@st.cache_resource
+def get_recognizer():
+    return sr.Recognizer()
+
+
+@st.cache_resource
+def get_http_session():
+    # Tanıma ve seslendirme istekleri aynı keep-alive havuzunu kullanır; böylece her kısa
+    # satır için yeni TLS el sıkışması yapılmaz. Havuz dolduğunda istekler bağlantı bekler.
+    retry = urllib3.util.Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+    )
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry, pool_block=True)
+    # Tanıma isteği bir kez gönderildikten sonra tekrarlanmaz: yeniden denemeler işin süre
+    # sınırını aşar. Yalnızca gövde gönderilmeden oluşan bağlantı hatası bir kez denenir.
+    speech_retry = urllib3.util.Retry(total=1, connect=1, read=0, status=0, redirect=0)
+    speech_adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE,
+                                                   max_retries=speech_retry, pool_block=True)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.mount(GOOGLE_SPEECH_PREFIX, speech_adapter)
+    return session
+
+
+def deadline_timeout(deadline):
+    # (bağlantı, okuma) zaman aşımı; okuma süresi işin kalan süresini geçmez
+    if deadline is None:
+        return HTTP_TIMEOUT
+    remaining = max(0.1, deadline - time.monotonic())
+    return min(HTTP_CONNECT_TIMEOUT, remaining), remaining
+
+
+# --- Ses Tanıma Servisi ---
+RECOGNITION_LANGUAGE = "tr-TR"
+RECOGNITION_TIMEOUT = 15
+RECOGNITION_WORKERS = 4
+RECOGNITION_MAX_PENDING = 32
+RECOGNITION_POLL_INTERVAL = 0.5
+# session_rerunner'ın dayandığı iç API'nin denendiği Streamlit sürümleri (dahil)
+SESSION_RERUN_VERSIONS = ((1, 32), (1, 66))
+STUB_TRANSCRIPT = os.environ.get("STUB_TRANSCRIPT", "")
+STUB_DELAY = float(os.environ.get("STUB_DELAY", 0.0))
+
+
+class RecognitionBusy(Exception):
+    pass
+
+
+class RecognitionBackend:
+    name = "base"
+
+    def recognize(self, audio, language=RECOGNITION_LANGUAGE, deadline=None):
+        # deadline: time.monotonic() cinsinden işin en geç bitmesi gereken an
+        raise NotImplementedError
+
+
+class GoogleBackend(RecognitionBackend):
+    name = "google"
+
+    def recognize(self, audio, language=RECOGNITION_LANGUAGE, deadline=None):
+        if not GOOGLE_SPEECH_KEY:
+            raise sr.RequestError("Google ses tanıma kapalı: GOOGLE_SPEECH_KEY tanımlı değil")
+        if sr.__version__.startswith(POOLED_SPEECH_RECOGNITION_VERSIONS):
+            return self._recognize_pooled(audio, language, deadline)
+        # Genel API: çağrıya özgü zaman aşımı için her istekte ayrı bir Recognizer
+        recognizer = sr.Recognizer()
+        recognizer.operation_timeout = deadline_timeout(deadline)[1]
+        return recognizer.recognize_google(audio, key=GOOGLE_SPEECH_KEY, language=language)
+
+    def _recognize_pooled(self, audio, language, deadline):
+        # speech_recognition 3.10'un recognize_google'ı ile aynı uç nokta ve yanıt biçimi, fakat
+        # urlopen yerine paylaşılan oturum üzerinden gönderilir.
+        params = {"client": "chromium", "lang": language, "key": GOOGLE_SPEECH_KEY, "pFilter": 0}
+        headers = {"Content-Type": f"audio/x-flac; rate={audio.sample_rate}"}
+        try:
+            response = get_http_session().post(GOOGLE_SPEECH_URL, params=params, headers=headers,
+                                               data=audio.get_flac_data(convert_width=2),
+                                               timeout=deadline_timeout(deadline))
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise sr.RequestError(f"recognition request failed: {e}")
+
+        try:
+            for line in response.text.split("\n"):
+                if not line:
+                    continue
+                result = json.loads(line)["result"]
+                if result:
+                    alternatives = result[0].get("alternative", [])
+                    if alternatives and "transcript" in alternatives[0]:
+                        return alternatives[0]["transcript"]
+                    break
+        except (ValueError, KeyError, IndexError, AttributeError) as e:
+            # Yanıt biçimi değişmiş: sessizce "anlaşılamadı" demek yerine hata olarak bildir
+            raise sr.RequestError(f"unexpected recognition response: {e!r}")
+        raise sr.UnknownValueError()
+
+
+class WhisperBackend(RecognitionBackend):
+    # Yerel (çevrimdışı) tanıma; model CPU üzerinde çalıştığı için çağrılar sıraya alınır.
+    name = "whisper"
+
+    def __init__(self, model=None):
+        self.recognizer = get_recognizer()
+        self.model = model or os.environ.get("WHISPER_MODEL", "base")
+        self._lock = threading.Lock()
+
+    def recognize(self, audio, language=RECOGNITION_LANGUAGE, deadline=None):
+        # Yerel model yarıda kesilemez; süre sınırı yalnızca servis tarafında uygulanır
+        with self._lock:
+            return self.recognizer.recognize_whisper(audio, model=self.model, language=language.split("-")[0])
+
+
+class StubBackend(RecognitionBackend):
+    # Testler için deterministik arka uç: sonuç yalnızca ses verisinin özetine bağlıdır.
+    # RECOGNITION_BACKEND=stub ile açıldığında yanıt ve gecikme STUB_TRANSCRIPT/STUB_DELAY'den gelir.
+    name = "stub"
+
+    def __init__(self, responses=None, default=None, delay=None):
+        self.responses = dict(responses or {})
+        self.default = STUB_TRANSCRIPT if default is None else default
+        self.delay = STUB_DELAY if delay is None else delay
+
+    @staticmethod
+    def audio_key(audio):
+        return hashlib.sha1(audio.get_raw_data()).hexdigest()
+
+    def recognize(self, audio, language=RECOGNITION_LANGUAGE, deadline=None):
+        if self.delay:
+            time.sleep(self.delay)
+        text = self.responses.get(self.audio_key(audio), self.default)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+RECOGNITION_BACKENDS = {
+    "google": GoogleBackend,
+    "whisper": WhisperBackend,
+    "stub": StubBackend,
+}
+
+
+class RecognitionJob:
+    # Her işin sonucu metriklere bir kez yazılır: süresi dolan iş poll'da "timeout" sayılır,
+    # arka uç daha sonra dönse bile _recognize ikinci bir sonuç eklemez.
+    __slots__ = ("future", "deadline", "outcome")
+
+    def __init__(self, deadline):
+        self.future = None
+        self.deadline = deadline
+        self.outcome = None
+
+
+class RecognitionService:
+    # İşler arka planda çalışır. Çalışmakta olan bir iş iptal edilemez (Future.cancel yalnızca
+    # kuyruktaki işleri durdurur); bu yüzden zaman aşımına uğrayan ya da iptal edilen işler de
+    # gerçekten bitene kadar max_pending sınırına sayılır.
+    def __init__(self, backend, max_workers=RECOGNITION_WORKERS, timeout=RECOGNITION_TIMEOUT,
+                 max_pending=RECOGNITION_MAX_PENDING):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recognition")
+        self._jobs = {}
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        # Sonucu hiç sorgulanmayan (sayfadan ayrılan kullanıcıların) işleri temizle
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if now > job.deadline + self.timeout]
+        for job_id in expired:
+            self._jobs.pop(job_id).future.cancel()
+
+    def _record(self, job, result):
+        with self._lock:
+            if job.outcome is not None:
+                return
+            job.outcome = result
+        METRICS.inc("poetry_recognition_total", backend=self.backend.name, result=result)
+
+    def _finished(self, future):
+        with self._lock:
+            self._running.discard(future)
+
+    def submit(self, audio, language=RECOGNITION_LANGUAGE):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if len(self._running) >= self.max_pending:
+                METRICS.inc("poetry_recognition_total", backend=self.backend.name, result="busy")
+                raise RecognitionBusy()
+            job_id = uuid.uuid4().hex
+            job = RecognitionJob(now + self.timeout)
+            job.future = self._executor.submit(self._recognize, audio, language, job)
+            self._running.add(job.future)
+            self._jobs[job_id] = job
+        job.future.add_done_callback(self._finished)
+        return job_id
+
+    def _recognize(self, audio, language, job):
+        if time.monotonic() > job.deadline:
+            # Kuyrukta beklerken süresi dolan işi arka uca hiç gönderme
+            self._record(job, "expired")
+            return None
+        result = "error"
+        try:
+            with METRICS.span("recognize", backend=self.backend.name):
+                text = self.backend.recognize(audio, language, deadline=job.deadline)
+            result = "ok"
+            return text
+        except sr.UnknownValueError:
+            result = "unknown"
+            raise
+        finally:
+            self._record(job, result)
+
+    def poll(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return "missing", None
+
+        future = job.future
+        if future.done():
+            self.cancel(job_id)
+            if future.cancelled():
+                return "cancelled", None
+            error = future.exception()
+            if error is not None:
+                return "error", error
+            return "done", future.result()
+        if time.monotonic() > job.deadline:
+            self.cancel(job_id)
+            self._record(job, "timeout")
+            return "timeout", None
+        return "pending", None
+
+    def watch(self, job_id, callback):
+        # İş bittiğinde ya da süresi dolduğunda callback'i (bir kez) arka planda çağırır;
+        # betiğin sonucu beklemek için uyuyup kendini yeniden çalıştırmasına gerek kalmaz.
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return
+        future, deadline = job.future, job.deadline
+        fired = threading.Lock()
+
+        def notify(*_):
+            if fired.acquire(blocking=False):
+                timer.cancel()
+                callback()
+
+        timer = threading.Timer(max(0.0, deadline - time.monotonic()) + 0.05, notify)
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(notify)
+
+    def cancel(self, job_id):
+        # Kuyruktaki iş hemen düşer; çalışmakta olan iş arka uç dönene kadar sürer
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.future.cancel()
+
+
+def streamlit_version():
+    try:
+        return tuple(int(part) for part in st.__version__.split(".")[:2])
+    except ValueError:
+        return None
+
+
+def session_rerunner():
+    # Arka plandaki bir iş bittiğinde bu oturumu yeniden çalıştıran fonksiyonu döner.
+    # streamlit-webrtc'nin de kullandığı Streamlit iç API'sine dayanır; bu yüzden yalnızca
+    # denenmiş sürümlerde kullanılır. Sürüm farklıysa, API değişmişse ya da çalışan bir
+    # sunucu yoksa (ör. AppTest) None döner ve çağıran poll_later ile yoklamaya düşer.
+    version = streamlit_version()
+    if version is None or not SESSION_RERUN_VERSIONS[0] <= version <= SESSION_RERUN_VERSIONS[1]:
+        return None
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
+    try:
+        session = Runtime.instance()._session_mgr.get_session_info(ctx.session_id).session
+        loop = session._event_loop
+        request_rerun = session.request_rerun
+    except Exception:
+        return None
+    if not callable(request_rerun) or not hasattr(loop, "call_soon_threadsafe"):
+        return None
+
+    def rerun():
+        try:
+            loop.call_soon_threadsafe(request_rerun, None)
+        except RuntimeError:
+            # Oturum kapanmış (olay döngüsü durmuş); yapılacak bir şey yok
+            pass
+    return rerun
+
+
+def poll_later():
+    # Arka plandan yeniden çalıştırma kullanılamadığında sonucu kısa aralıklarla yokla
+    with METRICS.span("poll_wait"):
+        time.sleep(RECOGNITION_POLL_INTERVAL)
+    st.rerun()
+
+
+@st.cache_resource
+def get_recognition_service():
+    default = "google" if GOOGLE_SPEECH_KEY else "whisper"
+    backend = RECOGNITION_BACKENDS[os.environ.get("RECOGNITION_BACKEND", default)]()
+    return RecognitionService(backend)
+
+
+# --- Canlı Değerlendirme ---
+STREAM_CHUNK_SECONDS = 2.5
+STREAM_REJECT_MARGIN = 0.05
+
+
+class StreamingRecitation:
+    # Kayıt sürerken sesi parçalar halinde tanıyıp satırla karşılaştırır; benzerlik eşiği
+    # geçtiğinde ya da artık geçemeyeceği anlaşıldığında denemeyi erken bitirir. Ses WebRTC
+    # iş parçacığından write ile gelir, tanıma sonuçları servisin geri çağrısıyla toplanır;
+    # betik yalnızca durumu çizer ve döküm ya da karar değiştiğinde yeniden çalıştırılır.
+    def __init__(self, target, normalized_target, threshold, service, rerun=None):
+        self.id = uuid.uuid4().hex
+        self.target = target
+        self.normalized_target = normalized_target
+        self.threshold = threshold
+        self.service = service
+        self.rerun = rerun
+        self.jobs = []
+        self.partials = {}
+        self.next_seq = 0
+        self.pending_samples = []
+        self.pending_size = 0
+        self.sample_rate = None
+        self.captured = 0
+        self.noise_floor = None
+        self.finished = False
+        self.cancelled = False
+        self.transcript = ""
+        self.similarity = 0.0
+        self.verdict = None
+        self._lock = threading.RLock()
+
+    def _submit(self, samples):
+        pcm = resample_audio(samples, self.sample_rate)
+        job_id = self.service.submit(flac_audio_data(pcm))
+        self.jobs.append((self.next_seq, job_id))
+        self.next_seq += 1
+        self.service.watch(job_id, self._on_result)
+
+    def _keep(self, samples):
+        self.pending_samples = [samples] if samples.size else []
+        self.pending_size = samples.size
+
+    def _flush(self, final):
+        # Parçaları sabit sürede değil, konuşmadaki duraklamalarda kes; sessiz kısımları hiç gönderme
+        rate = self.sample_rate
+        chunk = int(STREAM_CHUNK_SECONDS * rate)
+        while self.pending_size >= chunk or (final and self.pending_size):
+            samples = np.concatenate(self.pending_samples)
+            # Gürültü tabanı kayıt boyunca taşınır; sürekli konuşma içeren parça da algılanır
+            floor = speech_noise_floor(samples, rate)
+            if floor is not None:
+                self.noise_floor = floor if self.noise_floor is None else min(self.noise_floor, floor)
+            segments = detect_speech(samples, rate, noise_floor=self.noise_floor)
+            if not segments:
+                preroll = 0 if final else int(rate * VAD_PREROLL_FRAMES * VAD_FRAME_MS / 1000)
+                self._keep(samples[samples.size - preroll:])
+                continue
+
+            closed = [end for _, end in segments if end < samples.size]
+            if final:
+                cut = samples.size
+            elif closed:
+                cut = closed[-1]
+            elif samples.size >= 2 * chunk:
+                cut = chunk
+            else:
+                break
+
+            segments = [(start, min(end, cut)) for start, end in segments if start < cut]
+            self._submit(join_segments(samples, segments, rate))
+            self._keep(samples[cut:])
+
+    def _collect(self):
+        running = []
+        for seq, job_id in self.jobs:
+            status, result = self.service.poll(job_id)
+            if status == "pending":
+                running.append((seq, job_id))
+            else:
+                self.partials[seq] = result if status == "done" and result else ""
+        self.jobs = running
+
+    def _score(self):
+        texts = []
+        for seq in range(self.next_seq):
+            if seq not in self.partials:
+                break
+            if self.partials[seq]:
+                texts.append(self.partials[seq])
+        transcript = " ".join(texts)
+        if transcript == self.transcript:
+            return
+        self.transcript = transcript
+        spoken = clean_text(transcript)
+        self.similarity = sequence_similarity(self.normalized_target, spoken)
+        if self.similarity >= self.threshold:
+            self.verdict = "accept"
+        elif similarity_upper_bound(self.normalized_target, spoken) < self.threshold - STREAM_REJECT_MARGIN:
+            self.verdict = "reject"
+
+    def _settle(self):
+        if self.verdict is None and self.finished and not self.jobs and not self.pending_size:
+            if not self.next_seq:
+                self.verdict = "silent"
+            elif not self.transcript:
+                self.verdict = "unknown"
+            else:
+                self.verdict = "accept" if self.similarity >= self.threshold else "reject"
+
+    def _update(self, final=False):
+        # Çağıran kilidi tutar; görünür durum değiştiyse True döner
+        before = (self.transcript, self.verdict)
+        if self.verdict is None:
+            if self.sample_rate:
+                try:
+                    self._flush(final)
+                except RecognitionBusy:
+                    # Servis doluysa kalan ses bir sonraki fırsatta gönderilir; son
+                    # parçada bekleyecek fırsat kalmadığı için atılır
+                    if final:
+                        self._keep(np.empty(0, dtype=np.int16))
+            self._collect()
+            self._score()
+            self._settle()
+        if self.verdict is not None:
+            self._cancel_jobs()
+        return (self.transcript, self.verdict) != before
+
+    def _notify(self, changed):
+        if changed and self.rerun is not None and not self.cancelled:
+            self.rerun()
+
+    def write(self, samples, sample_rate):
+        # WebRTC iş parçacığından çağrılır
+        with self._lock:
+            if self.cancelled or self.finished or self.verdict is not None:
+                return 0
+            self.sample_rate = self.sample_rate or sample_rate
+            limit = MAX_UTTERANCE_SECONDS * self.sample_rate
+            samples = samples[:limit - self.captured]
+            self.captured += samples.size
+            self.pending_samples.append(samples)
+            self.pending_size += samples.size
+            self.finished = self.captured >= limit
+            changed = self._update(final=self.finished)
+        self._notify(changed)
+        return samples.size
+
+    def _on_result(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            changed = self._update(final=self.finished)
+        self._notify(changed)
+
+    def finish(self):
+        # Mikrofon kapandığında betikten çağrılır; kalan sesi gönderir
+        with self._lock:
+            if not self.finished and not self.cancelled:
+                self.finished = True
+                self._update(final=True)
+
+    def _cancel_jobs(self):
+        jobs, self.jobs = self.jobs, []
+        for _, job_id in jobs:
+            self.service.cancel(job_id)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            self._cancel_jobs()
+
+
+def reset_recitation_stream():
+    stream = st.session_state.get('recitation_stream')
+    if stream is not None:
+        stream.cancel()
+    st.session_state.recitation_stream = None
+    get_capture_buffer().reset()
+
+
+# --- Seslendirme (TTS) Önbelleği ---
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "poetrymaster-tts"))
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+TTS_PREFETCH_LINES = 3
+TTS_PREFETCH_WORKERS = 2
+TTS_PREFETCH_BACKOFF = 5.0
+TTS_PREFETCH_MAX_BACKOFF = 300.0
+
+
+def tts_cache_key(text, lang='tr'):
+    return hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    # İçerik adresli disk önbelleği. Dosyalar atomik olarak yazılır, okunan dosyanın
+    # mtime değeri güncellenir ve boyut sınırı aşıldığında en eski dosyalar silinir.
+    # Aynı anahtarın birden çok süreçte aynı anda üretilmesi dosya kilitleriyle engellenir.
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._size_lock = threading.Lock()
+        self._stripes = defaultdict(threading.Lock)
+        os.makedirs(os.path.join(directory, "locks"), exist_ok=True)
+
+    def path(self, key, suffix=".mp3"):
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def get(self, key, suffix=".mp3"):
+        path = self.path(key, suffix)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def contains(self, key, suffix=".mp3"):
+        return os.path.exists(self.path(key, suffix))
+
+    def put(self, key, data, suffix=".mp3"):
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._account(len(data))
+
+    def get_or_create(self, key, factory, suffix=".mp3"):
+        kind = suffix.lstrip(".")
+        data = self.get(key, suffix)
+        if data is not None:
+            METRICS.inc("poetry_tts_cache_total", kind=kind, result="hit")
+            return data
+        with self._locked(key):
+            data = self.get(key, suffix)
+            if data is None:
+                METRICS.inc("poetry_tts_cache_total", kind=kind, result="miss")
+                with METRICS.span("synthesize", kind=kind):
+                    data = factory()
+                self.put(key, data, suffix)
+            else:
+                # Başka bir oturum aynı sesi biz beklerken üretti
+                METRICS.inc("poetry_tts_cache_total", kind=kind, result="wait")
+            return data
+
+    @contextmanager
+    def _locked(self, key):
+        with self._stripes[key[:2]]:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, "locks", key[:2] + ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            if os.path.basename(root) == "locks":
+                continue
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                yield os.path.join(root, name), stat.st_size, stat.st_mtime
+
+    def _account(self, added):
+        with self._size_lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += added
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def _evict(self):
+        lock_file = None
+        if fcntl is not None:
+            lock_file = open(os.path.join(self.directory, "locks", "evict.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Başka bir süreç zaten temizlik yapıyor
+                lock_file.close()
+                return 0
+        try:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            return total
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+
+@st.cache_resource
+def get_tts_cache():
+    return TTSCache()
+
+
+class TTSPrefetcher:
+    # Her yeniden çalıştırmada aynı anahtar için yeni iş kuyruğa girmesin: çalışan anahtarlar
+    # izlenir, başarısız olanlar üstel artan bir süre boyunca yeniden denenmez.
+    def __init__(self, max_workers=TTS_PREFETCH_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-prefetch")
+        self._lock = threading.Lock()
+        self._running = set()
+        self._failures = {}
+
+    def submit(self, key, fn, *args):
+        now = time.monotonic()
+        with self._lock:
+            if key in self._running:
+                return False
+            failure = self._failures.get(key)
+            if failure is not None and now < failure[1]:
+                return False
+            self._running.add(key)
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._done(key, f))
+        return True
+
+    def _done(self, key, future):
+        error = None if future.cancelled() else future.exception()
+        with self._lock:
+            self._running.discard(key)
+            if error is None:
+                self._failures.pop(key, None)
+                return
+            count = self._failures.get(key, (0, 0.0))[0] + 1
+            delay = min(TTS_PREFETCH_BACKOFF * 2 ** (count - 1), TTS_PREFETCH_MAX_BACKOFF)
+            self._failures[key] = (count, time.monotonic() + delay)
+        logger.warning("Seslendirme ön yüklemesi başarısız (%s, %d. deneme, %.0f sn sonra yeniden): %s",
+                       key, count, delay, error)
+
+
+@st.cache_resource
+def get_tts_prefetcher():
+    return TTSPrefetcher()
+
+
+class GTTSFormatError(ValueError):
+    pass
+
+
+def synthesize_speech(text, lang='tr'):
+    tts = gtts.gTTS(text=text, lang=lang, timeout=HTTP_TIMEOUT)
+    if gtts.__version__.startswith(POOLED_GTTS_VERSIONS) and hasattr(tts, "_prepare_requests"):
+        try:
+            return pooled_speech(tts)
+        except GTTSFormatError:
+            logger.warning("gTTS yanıt biçimi tanınmadı; genel API'ye dönülüyor", exc_info=True)
+    audio_bytes = io.BytesIO()
+    tts.write_to_fp(audio_bytes)
+    return audio_bytes.getvalue()
+
+
+def pooled_speech(tts):
+    # gTTS.stream her parça için yeni bir requests.Session açar; hazırlanan istekleri
+    # paylaşılan oturumla gönderip yanıtı gTTS 2.5'in yaptığı gibi çözüyoruz.
+    session = get_http_session()
+    audio_bytes = io.BytesIO()
+    for request in tts._prepare_requests():
+        try:
+            response = session.send(request, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+        except requests.HTTPError:
+            raise gtts.gTTSError(tts=tts, response=response)
+        except requests.RequestException:
+            raise gtts.gTTSError(tts=tts)
+        audio_bytes.write(decode_gtts_response(tts, response))
+    return audio_bytes.getvalue()
+
+
+def decode_gtts_response(tts, response):
+    for line in response.text.splitlines():
+        if "jQ1olc" in line:
+            match = re.search(r'jQ1olc","\[\\"(.*)\\"]', line)
+            if match:
+                return base64.b64decode(match.group(1).encode("ascii"))
+            break
+    raise GTTSFormatError(f"beklenmeyen gTTS yanıtı ({len(response.text)} bayt)")
+
+
+def cached_speech(text, lang='tr'):
+    return get_tts_cache().get_or_create(tts_cache_key(text, lang), lambda: synthesize_speech(text, lang))
 
 
-@st.cache_data(ttl=3600)
 def text_to_speech(text, lang='tr', slow=False):
     try:
-        tts = gTTS(text=text, lang=lang, slow=slow)
+        data = cached_speech(text, lang)
+        if not slow:
+            return io.BytesIO(data)
+        samples, rate = decode_audio(data)
         audio_bytes = io.BytesIO()
-        tts.write_to_fp(audio_bytes)
+        wavfile.write(audio_bytes, rate, stretched_speech(tts_cache_key(text, lang), samples, SLOW_SPEED))
         audio_bytes.seek(0)
         return audio_bytes
     except Exception as e:
@@ -225,15 +2542,283 @@ def text_to_speech(text, lang='tr', slow=False):
         return None
 
 
-def shuffle_words(line):
-    words = re.findall(r"\w+|[^\w\s]", line)
-    shuffled = words.copy()
-    if len(shuffled) > 3:
-        while True:
-            random.shuffle(shuffled)
-            if " ".join(shuffled) != line:
-                break
-    return shuffled, words
+# --- Oynatma Hızı ---
+PLAYBACK_SPEEDS = [0.6, 0.75, 0.9, 1.0, 1.1, 1.2]
+AGE_PLAYBACK_SPEED = {
+    "Çocuk (7-12)": 0.75,
+    "Genç (13-18)": 1.0,
+    "Yetişkin (18-65)": 1.0,
+    "Yaşlı (65+)": 0.75,
+}
+SLOW_SPEED = 0.75
+STRETCH_FRAME = 1024
+STRETCH_HOP = 256
+
+
+def time_stretch(samples, speed, frame=STRETCH_FRAME, hop=STRETCH_HOP):
+    # Faz vokoderi: spektrum `speed` adımlarıyla örneklenir ve faz ilerlemesi korunarak
+    # yeniden sentezlenir; böylece süre değişir, perde değişmez.
+    if speed == 1.0 or samples.size < frame:
+        return samples
+
+    x = samples.astype(np.float32) / 32768
+    window = np.hanning(frame).astype(np.float32)
+    n_frames = 1 + (x.size - frame) // hop
+    index = np.arange(frame)[None, :] + hop * np.arange(n_frames)[:, None]
+    spectrum = np.fft.rfft(x[index] * window, axis=1)
+
+    steps = np.arange(0, n_frames - 1, speed)
+    low = steps.astype(np.int64)
+    frac = (steps - low)[:, None]
+    magnitude = (1 - frac) * np.abs(spectrum[low]) + frac * np.abs(spectrum[low + 1])
+
+    expected = 2 * np.pi * hop * np.arange(frame // 2 + 1) / frame
+    delta = np.angle(spectrum[low + 1]) - np.angle(spectrum[low]) - expected
+    delta -= 2 * np.pi * np.round(delta / (2 * np.pi))
+    advance = np.cumsum(expected + delta, axis=0)
+    phase = np.angle(spectrum[0]) + np.vstack([np.zeros_like(expected), advance[:-1]])
+
+    frames_out = np.fft.irfft(magnitude * np.exp(1j * phase), n=frame, axis=1) * window
+    out_index = np.arange(frame)[None, :] + hop * np.arange(steps.size)[:, None]
+    out = np.zeros(hop * (steps.size - 1) + frame)
+    norm = np.zeros_like(out)
+    np.add.at(out, out_index, frames_out)
+    np.add.at(norm, out_index, np.broadcast_to(window ** 2, frames_out.shape))
+    out /= np.maximum(norm, 1e-3)
+    return np.clip(out * 32768, -32768, 32767).astype(np.int16)
+
+
+def stretched_speech(key, samples, speed):
+    # Hız varyantları ağ üzerinden yeniden sentezlenmez; normal hızdaki sesten türetilip
+    # aynı önbellekte saklanır.
+    if speed == 1.0:
+        return samples
+
+    def stretch():
+        buffer = io.BytesIO()
+        np.save(buffer, time_stretch(samples, speed))
+        return buffer.getvalue()
+
+    data = get_tts_cache().get_or_create(f"{key}@{speed:.2f}", stretch, ".npy")
+    return np.load(io.BytesIO(data))
+
+
+# --- Şiir Bazında Seslendirme ---
+POEM_SILENCE_MIN_SECONDS = 0.15
+
+
+def decode_audio(data):
+    with av.open(io.BytesIO(data)) as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=stream.rate or 24000)
+        rate = resampler.rate
+        chunks = []
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray().reshape(-1))
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+    return (np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)), rate
+
+
+def find_line_boundaries(samples, rate, lines):
+    # Sessizlik aralıklarından satır sayısı kadar sınır seç: her sınır, satır uzunluklarından
+    # beklenen konuma en yakın olacak şekilde dinamik programlama ile eşleştirilir.
+    segments = detect_speech(samples, rate, split_seconds=POEM_SILENCE_MIN_SECONDS, hangover=2)
+    gaps = [(end, start) for (_, end), (start, _) in zip(segments[:-1], segments[1:])
+            if start - end >= POEM_SILENCE_MIN_SECONDS * rate]
+    needed = len(lines) - 1
+    if needed == 0:
+        return [(0, samples.size)]
+    if len(gaps) < needed or not segments:
+        return None
+
+    speech_start, speech_end = segments[0][0], segments[-1][1]
+    lengths = np.array([len(clean_text(line)) + 1 for line in lines], dtype=np.float64)
+    expected = speech_start + np.cumsum(lengths)[:-1] / lengths.sum() * (speech_end - speech_start)
+    centers = np.array([(gap_start + gap_end) / 2 for gap_start, gap_end in gaps])
+    widths = np.array([gap_end - gap_start for gap_start, gap_end in gaps], dtype=np.float64)
+
+    # Uzun sessizlikler satır sonu olmaya daha yatkındır
+    cost = np.abs(centers[None, :] - expected[:, None]) - 0.5 * widths[None, :]
+    m = len(gaps)
+    best = np.full((needed, m), np.inf)
+    choice = np.zeros((needed, m), dtype=np.int64)
+    best[0] = cost[0]
+    for i in range(1, needed):
+        running = np.minimum.accumulate(best[i - 1])
+        arg = np.zeros(m, dtype=np.int64)
+        for j in range(1, m):
+            arg[j] = arg[j - 1] if best[i - 1][arg[j - 1]] <= best[i - 1][j - 1] else j - 1
+        best[i, 1:] = running[:-1] + cost[i, 1:]
+        choice[i] = arg
+
+    picked = [int(np.argmin(best[-1]))]
+    for i in range(needed - 1, 0, -1):
+        picked.append(int(choice[i][picked[-1]]))
+    picked.reverse()
+
+    cuts = [0] + [gaps[j][0] + (gaps[j][1] - gaps[j][0]) // 2 for j in picked] + [samples.size]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def poem_speech_key(lines, lang='tr'):
+    return tts_cache_key("\n".join(lines), lang)
+
+
+def synthesize_poem(lines, lang='tr'):
+    samples, rate = decode_audio(synthesize_speech("\n".join(lines), lang))
+    boundaries = find_line_boundaries(samples, rate, lines)
+    if boundaries is None:
+        # Hizalama başarısız: boş ofsetler satır satır seslendirmeye dönüleceğini belirtir
+        samples, boundaries = samples[:0], []
+    buffer = io.BytesIO()
+    np.savez(buffer, samples=samples, rate=np.array(rate),
+             offsets=np.array(boundaries, dtype=np.int64).reshape(-1, 2))
+    return buffer.getvalue()
+
+
+def cached_poem_speech(lines, lang='tr'):
+    return get_tts_cache().get_or_create(poem_speech_key(lines, lang),
+                                         lambda: synthesize_poem(lines, lang), ".npz")
+
+
+@st.cache_resource(max_entries=32)
+def load_poem_speech(key):
+    data = get_tts_cache().get(key, ".npz")
+    if data is None:
+        # contains() ile okuma arasında önbellekten atılmış olabilir
+        raise FileNotFoundError(key)
+    with np.load(io.BytesIO(data)) as data:
+        return data["samples"], int(data["rate"]), data["offsets"]
+
+
+def poem_line_speech(lines, index, lang='tr'):
+    key = poem_speech_key(lines, lang)
+    if not get_tts_cache().contains(key, ".npz"):
+        return None
+    try:
+        samples, rate, offsets = load_poem_speech(key)
+    except Exception:
+        # Silinmiş ya da bozuk kayıt: satır satır seslendirmeye dön
+        logger.warning("Şiir seslendirmesi okunamadı: %s", key, exc_info=True)
+        return None
+    if len(offsets) != len(lines):
+        return None
+    start, end = offsets[index]
+    return samples[start:end], rate
+
+
+def play_line(poem_data, index, speed=1.0):
+    lines = poem_data["content"]
+    sliced = poem_line_speech(lines, index)
+    if sliced is not None:
+        samples, rate = sliced
+        key = f"{poem_speech_key(lines)}-{index}"
+    else:
+        if speed == 1.0:
+            audio = text_to_speech(lines[index])
+            if audio:
+                st.audio(audio)
+            return
+        try:
+            samples, rate = decode_audio(cached_speech(lines[index]))
+        except Exception:
+            st.error("Ses oluşturulurken bir hata oluştu.")
+            return
+        key = tts_cache_key(lines[index])
+
+    st.audio(stretched_speech(key, samples, speed), sample_rate=rate)
+
+
+def prefetch_poem_speech(lines, index, lang='tr'):
+    key = poem_speech_key(lines, lang)
+    if not get_tts_cache().contains(key, ".npz"):
+        get_tts_prefetcher().submit(f"{key}.npz", cached_poem_speech, lines, lang)
+    elif poem_line_speech(lines, index, lang) is None:
+        prefetch_speech(lines[index + 1:index + 1 + TTS_PREFETCH_LINES], lang)
+
+
+def prefetch_speech(lines, lang='tr'):
+    cache = get_tts_cache()
+    prefetcher = get_tts_prefetcher()
+    for line in lines:
+        key = tts_cache_key(line, lang)
+        if not cache.contains(key):
+            prefetcher.submit(key, cached_speech, line, lang)
+
+
+# --- Alıştırma Üretici ---
+EXERCISE_SEED = int(os.environ.get("EXERCISE_SEED", 0))
+CLOZE_EVERY = 3
+CLOZE_BLANK = "_____"
+
+
+def scramble_indices(n, rng=random):
+    # Sattolo algoritması: tek bir n-döngüsü üretir, hiçbir kelime yerinde kalmaz.
+    # Tek geçişte biter ve (tüm kelimeler aynı değilse) karışık satır asla doğru satıra eşit olmaz.
+    order = list(range(n))
+    for i in range(n - 1, 0, -1):
+        j = rng.randrange(i)
+        order[i], order[j] = order[j], order[i]
+    return order
+
+
+def is_word_token(token):
+    return token[0].isalnum() or token == CLOZE_BLANK
+
+
+def join_tokens(tokens):
+    text = ""
+    for token in tokens:
+        if text and is_word_token(token) and not text.endswith(("'", "’")):
+            text += " "
+        text += token
+    return text
+
+
+def exercise_rng(title, line_no, seed=EXERCISE_SEED):
+    digest = hashlib.sha256(f"{seed}\0{title}\0{line_no}".encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+class PoemExercises:
+    # Şiir yüklendiğinde tüm satırlar için kelime sıralama, boşluk doldurma ve ilk harf ipucu
+    # alıştırmaları bir kez üretilir. Kelimeler satırdaki sabit indeksleriyle temsil edilir.
+    def __init__(self, title, index, seed=EXERCISE_SEED):
+        self.tokens = index.display_tokens
+        self.word_sort = []
+        self.cloze = []
+        self.hints = []
+        for line_no, tokens in enumerate(self.tokens):
+            rng = exercise_rng(title, line_no, seed)
+            self.word_sort.append(scramble_indices(len(tokens), rng))
+
+            # Kesme işaretinden sonraki ekler ("Hakk'a") kelimeyle birlikte kalır.
+            words = [i for i, token in enumerate(tokens)
+                     if token[0].isalnum() and (i == 0 or tokens[i - 1] not in ("'", "’"))]
+            offset = rng.randrange(CLOZE_EVERY) if words else 0
+            blanks = set(words[offset::CLOZE_EVERY])
+            self.cloze.append(join_tokens(CLOZE_BLANK if i in blanks else token for i, token in enumerate(tokens)))
+            self.hints.append(join_tokens(tokens[i][0] + "…" if i in words else tokens[i] for i in range(len(tokens))))
+
+    def scrambled(self, line_no):
+        return [self.tokens[line_no][i] for i in self.word_sort[line_no]]
+
+    def is_correct_order(self, line_no, picked):
+        # picked: karışık listedeki konumlar. Aynı kelime birden çok kez geçiyorsa yerleri değiştirilebilir.
+        # Tarayıcıdan gelir: her konumun tam bir kez seçildiği bir permütasyon olmalıdır
+        order = self.word_sort[line_no]
+        if not isinstance(picked, list) or not all(type(k) is int for k in picked):
+            return False
+        if sorted(picked) != list(range(len(order))):
+            return False
+        return [self.tokens[line_no][order[k]] for k in picked] == self.tokens[line_no]
+
+
+@st.cache_resource
+def get_poem_exercises(title):
+    return PoemExercises(title, get_poem_index(title))
 
 
 def generate_poem_background(poem_data):
@@ -254,19 +2839,29 @@ def init_session():
     if 'completed_lines' not in st.session_state:
         st.session_state.completed_lines = []
     if 'selected_poem' not in st.session_state:
-        st.session_state.selected_poem = list(siirler.keys())[0]
-    if 'selected_words' not in st.session_state:
-        st.session_state.selected_words = []
-    if 'word_scores' not in st.session_state:
-        st.session_state.word_scores = defaultdict(int)
+        st.session_state.selected_poem = get_corpus().titles(1)[0]
     if 'audio_enabled' not in st.session_state:
         st.session_state.audio_enabled = True
+    if 'streaming_mode' not in st.session_state:
+        st.session_state.streaming_mode = True
+    if 'user_id' not in st.session_state:
+        # Kullanıcı kimliği adres çubuğunda tutulur; sayfa yenilendiğinde aynı kullanıcı devam eder
+        if "u" not in st.query_params:
+            st.query_params["u"] = uuid.uuid4().hex
+        st.session_state.user_id = st.query_params["u"]
 
 
 init_session()
 
 
 # --- Kullanıcı Arayüzü Bileşenleri ---
+# Kelime sıralama tarayıcıda yapılır; sunucu yalnızca "Kontrol Et" ile gelen son sırayı görür
+word_sort_component = components.declare_component(
+    "word_sort",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "word_sort")
+)
+
+
 def user_profile_card():
     with st.sidebar:
         st.markdown("""
@@ -287,24 +2882,30 @@ def user_profile_card():
 
 
 def poem_selection_card():
+    query = st.sidebar.text_input("🔎 Şiir veya Şair Ara", key="poem_query", placeholder="Örn. Sessiz Gemi")
+    options = get_corpus().search(query)
+    if st.session_state.selected_poem not in options:
+        options = [st.session_state.selected_poem] + options
+
     st.session_state.selected_poem = st.sidebar.selectbox(
         "📜 Şiir Seçin",
-        list(siirler.keys()),
+        options,
+        index=options.index(st.session_state.selected_poem),
         key="poem_selector"
     )
 
-    poem_data = siirler[st.session_state.selected_poem]
+    poem_data = get_corpus().metadata(st.session_state.selected_poem)
     st.sidebar.markdown(f"""
     <div style="background-color: {poem_data['bg_color']}; border-radius: 12px; padding: 1rem; margin-top: 1rem;">
         <p style="font-weight: 500; margin-bottom: 0.5rem;">Şair: <strong>{poem_data['author']}</strong></p>
         <p style="margin-bottom: 0.5rem;">Zorluk: <strong>{poem_data.get('difficulty', 'Belirtilmemiş')}</strong></p>
-        <p style="margin-bottom: 0;">Toplam Satır: <strong>{len(poem_data['content'])}</strong></p>
+        <p style="margin-bottom: 0;">Toplam Satır: <strong>{poem_data['line_count']}</strong></p>
     </div>
     """, unsafe_allow_html=True)
 
 
 def progress_tracker():
-    poem_data = siirler[st.session_state.selected_poem]
+    poem_data = load_poem(st.session_state.selected_poem)
     progress = (st.session_state.line_index) / len(poem_data["content"])
 
     st.markdown(f"""
@@ -320,6 +2921,40 @@ def progress_tracker():
     """, unsafe_allow_html=True)
 
 
+FLASH_SECONDS = 3.0
+
+
+def advance_line(message_html):
+    # Doğru cevaptan sonra beklemeden sonraki satıra geçilir; tebrik mesajı oturumda bir
+    # son geçerlilik zamanıyla saklanır ve sonraki çizimlerde show_flash tarafından gösterilir.
+    st.session_state.flash = (message_html, time.time() + FLASH_SECONDS)
+    if st.session_state.get('review_line') is not None:
+        # Tekrar edilen satır kaldığınız yeri ilerletmez
+        st.session_state.review_line = None
+    else:
+        st.session_state.completed_lines.append(st.session_state.line_index)
+        st.session_state.line_index += 1
+    st.session_state.current_mode = "show"
+    st.rerun()
+
+
+def active_line():
+    # Test edilen satır: tekrar sırasında review_line, aksi halde kaldığınız satır
+    review_line = st.session_state.get('review_line')
+    return st.session_state.line_index if review_line is None else review_line
+
+
+def show_flash():
+    flash = st.session_state.get('flash')
+    if flash is None:
+        return
+    message_html, expires = flash
+    if time.time() > expires:
+        del st.session_state.flash
+        return
+    st.markdown(message_html, unsafe_allow_html=True)
+
+
 def show_line(poem_data):
     current_line = poem_data["content"][st.session_state.line_index]
 
@@ -329,14 +2964,22 @@ def show_line(poem_data):
     </div>
     """, unsafe_allow_html=True)
 
+    speed = st.select_slider(
+        "🐢 Okuma Hızı",
+        options=PLAYBACK_SPEEDS,
+        value=AGE_PLAYBACK_SPEED.get(st.session_state.user_age, 1.0),
+        format_func=lambda v: f"{v:g}x",
+        disabled=not st.session_state.audio_enabled
+    )
+
     col1, col2, col3 = st.columns([1, 1, 1])
     with col1:
         if st.button("🔊 Sesli Oku", use_container_width=True, disabled=not st.session_state.audio_enabled):
-            audio = text_to_speech(current_line)
-            if audio:
-                st.audio(audio)
+            play_line(poem_data, st.session_state.line_index, speed)
     with col2:
         if st.button("🎤 Sesli Test", type="primary", use_container_width=True):
+            st.session_state.recognition_job = None
+            reset_recitation_stream()
             st.session_state.current_mode = "test"
             st.rerun()
     with col3:
@@ -344,6 +2987,16 @@ def show_line(poem_data):
             st.session_state.current_mode = "word_sort"
             st.rerun()
 
+    if st.session_state.audio_enabled:
+        prefetch_poem_speech(poem_data["content"], st.session_state.line_index)
+
+    if st.button("🎙️ Serbest Okuma", use_container_width=True,
+                 help="Şiirin istediğiniz yerinden okuyun, hangi satırları söylediğinizi bulalım"):
+        get_capture_buffer().reset()
+        st.session_state.free_job = None
+        st.session_state.current_mode = "free"
+        st.rerun()
+
     with st.expander("📌 Ezberleme Teknikleri"):
         st.markdown("""
         - **Yüksek sesle okuyun**: Duyarak öğrenmek daha etkilidir
@@ -357,12 +3010,16 @@ def show_line(poem_data):
         st.markdown("---")
         if st.button(f"🧩 {st.session_state.line_index - 3}-{st.session_state.line_index} arası grup testi yap",
                      use_container_width=True):
+            get_capture_buffer().reset()
+            st.session_state.group_job = None
+            st.session_state.group_result = None
             st.session_state.current_mode = "group_test"
             st.rerun()
 
 
 def test_line(poem_data):
-    current_line = poem_data["content"][st.session_state.line_index]
+    line_no = active_line()
+    current_line = poem_data["content"][line_no]
 
     st.markdown(f"""
     <div style="background-color: #f5f5f5; border-radius: 12px; padding: 1.5rem; margin-bottom: 2rem;">
@@ -371,69 +3028,273 @@ def test_line(poem_data):
     </div>
     """, unsafe_allow_html=True)
 
-    wav_file = record_audio()
-    if not wav_file:
+    if st.session_state.get('review_line') is not None:
+        st.caption(f"🔁 Tekrar: {line_no + 1}. satır")
+        if st.button("✖️ Tekrarı Bırak", key="leave_review"):
+            st.session_state.review_line = None
+            st.session_state.current_mode = "show"
+            st.rerun()
+
+    with st.expander("💡 İpucu"):
+        exercises = get_poem_exercises(st.session_state.selected_poem)
+        st.markdown(f"**Boşluk doldurma:** {exercises.cloze[line_no]}")
+        st.markdown(f"**İlk harfler:** {exercises.hints[line_no]}")
+
+    if st.session_state.streaming_mode:
+        stream_test_line(current_line)
+        return
+
+    spoken_text = recognize_recording('recognition_job')
+    if spoken_text is not None:
+        show_test_result(current_line, spoken_text)
+
+
+def recognize_recording(job_key):
+    # Kaydı alır, tanıma servisine gönderir ve sonucu yoklar. Tanınan metni döner;
+    # sonuç henüz yoksa ya da hata oluştuysa ilgili arayüzü çizip None döner.
+    service = get_recognition_service()
+    job_id = st.session_state.get(job_key)
+
+    if job_id is None:
+        with METRICS.span("record_audio"):
+            audio = record_audio()
+        if audio is None:
+            st.button("🔁 Tekrar Dene", key="retry_recording")
+            return None
+        try:
+            job_id = service.submit(audio)
+        except RecognitionBusy:
+            st.error("Sunucu şu anda çok yoğun. Lütfen birkaç saniye sonra tekrar deneyin.")
+            st.button("🔁 Tekrar Dene", key="retry_busy")
+            return None
+        st.session_state[job_key] = job_id
+        rerun = session_rerunner()
+        st.session_state[job_key + "_watched"] = rerun is not None
+        if rerun is not None:
+            # Sonuç gelince oturum arka plandan yeniden çalıştırılır; betik beklemez
+            service.watch(job_id, rerun)
+
+    status, result = service.poll(job_id)
+    if status == "pending":
+        st.info("⏳ Sesiniz tanınıyor...")
+        if st.button("✖️ İptal", key="cancel_recognition"):
+            service.cancel(job_id)
+            st.session_state[job_key] = None
+            st.rerun()
+        if not st.session_state.get(job_key + "_watched"):
+            poll_later()
+        return None
+
+    st.session_state[job_key] = None
+    if status == "timeout":
+        st.error("Ses tanıma zaman aşımına uğradı. Lütfen tekrar deneyin.")
+        st.button("🔁 Tekrar Dene", key="retry_timeout")
+    elif status == "error":
+        if isinstance(result, sr.UnknownValueError):
+            st.error("Ses anlaşılamadı. Lütfen daha net ve yakından konuşarak tekrar deneyin.")
+            st.button("🔁 Tekrar Dene", key="retry_unknown")
+        else:
+            st.error(f"Bir hata oluştu: {str(result)}")
+    elif status == "done":
+        return result
+    else:
         st.button("🔁 Tekrar Dene", key="retry_recording")
+    return None
+
+
+def stream_test_line(current_line):
+    stream = st.session_state.get('recitation_stream')
+    if stream is None or stream.target != current_line:
+        reset_recitation_stream()
+        index = get_poem_index(st.session_state.selected_poem)
+        stream = StreamingRecitation(current_line, index.normalized[active_line()],
+                                     st.session_state.threshold, get_recognition_service(),
+                                     rerun=session_rerunner())
+        st.session_state.recitation_stream = stream
+
+    if stream.verdict is None:
+        ctx = start_capture(stream)
+        if not ctx.state.playing and stream.captured:
+            stream.finish()
+
+    if stream.verdict is None:
+        if stream.captured:
+            st.progress(min(stream.similarity / stream.threshold, 1.0),
+                        text=f"Canlı benzerlik: {stream.similarity:.0%}")
+            if stream.transcript:
+                st.caption(f"🗣️ {stream.transcript}")
+        if stream.finished:
+            st.info("⏳ Sesiniz tanınıyor...")
+        st.button("🔁 Tekrar Dene", key="retry_recording", on_click=reset_recitation_stream)
+        if stream.finished and stream.rerun is None:
+            poll_later()
         return
 
-    recognizer = sr.Recognizer()
+    if stream.verdict == "silent":
+        st.warning("🔇 Konuşma algılanmadı. Lütfen mikrofona yakın konuşarak tekrar deneyin.")
+        st.button("🔁 Tekrar Dene", key="retry_silent", on_click=reset_recitation_stream)
+    elif stream.verdict == "unknown":
+        st.error("Ses anlaşılamadı. Lütfen daha net ve yakından konuşarak tekrar deneyin.")
+        st.button("🔁 Tekrar Dene", key="retry_unknown", on_click=reset_recitation_stream)
+    else:
+        show_test_result(current_line, stream.transcript, on_retry=reset_recitation_stream, attempt=stream.id)
 
-    try:
-        with sr.AudioFile(wav_file) as source:
-            audio = recognizer.record(source)
-        spoken_text = recognizer.recognize_google(audio, language="tr-TR")
 
+def show_test_result(current_line, spoken_text, on_retry=None, attempt=None):
+    st.markdown(f"""
+    <div style="background-color: #ffffff; border-radius: 12px; padding: 1.5rem; margin: 1rem 0; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
+        <h4 style="margin-top: 0;">🗣️ Söylediğiniz:</h4>
+        <p style="font-size: 1.1rem;">{spoken_text}</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    index = get_poem_index(st.session_state.selected_poem)
+    line_no = active_line()
+    similarity, is_correct = index.similarity(line_no, spoken_text, st.session_state.threshold)
+
+    if attempt is None or st.session_state.get('last_graded_attempt') != attempt:
+        st.session_state.last_graded_attempt = attempt
+        record_score(line_no, similarity)
+
+    if is_correct:
+        advance_line(f"""
+        <div class="success-box" style="padding: 1.5rem; border-radius: 12px; margin: 1rem 0;">
+            <h4 style="color: var(--accent-color); margin-top: 0;">✅ Tebrikler! Doğru okudunuz!</h4>
+            <p>Benzerlik Oranı: <strong>{similarity:.0%}</strong></p>
+        </div>
+        """)
+    else:
         st.markdown(f"""
-        <div style="background-color: #ffffff; border-radius: 12px; padding: 1.5rem; margin: 1rem 0; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
-            <h4 style="margin-top: 0;">🗣️ Söylediğiniz:</h4>
-            <p style="font-size: 1.1rem;">{spoken_text}</p>
+        <div class="error-box" style="padding: 1.5rem; border-radius: 12px; margin: 1rem 0;">
+            <h4 style="color: var(--error-color); margin-top: 0;">❌ Tekrar denemeniz gerekiyor</h4>
+            <p>Benzerlik Oranı: <strong>{similarity:.0%}</strong></p>
+            <p>Doğru satır: <em>{highlight_line(current_line, spoken_text)}</em></p>
+            <p style="font-size: 0.9rem; color: #666;">Sarı: yanlış söylenen, kırmızı: atlanan kelimeler</p>
         </div>
         """, unsafe_allow_html=True)
 
-        similarity, is_correct = check_similarity(current_line, spoken_text, st.session_state.threshold)
+        st.button("🔁 Tekrar Dene", key="retry_test", type="primary", on_click=on_retry)
 
-        if is_correct:
-            st.session_state.word_scores[st.session_state.line_index] = similarity
-            st.markdown(f"""
-            <div class="success-box" style="padding: 1.5rem; border-radius: 12px; margin: 1rem 0;">
-                <h4 style="color: var(--accent-color); margin-top: 0;">✅ Tebrikler! Doğru okudunuz!</h4>
-                <p>Benzerlik Oranı: <strong>{similarity:.0%}</strong></p>
-                <p>Sonraki satıra geçiliyor...</p>
-            </div>
-            """, unsafe_allow_html=True)
 
-            st.session_state.completed_lines.append(st.session_state.line_index)
-            st.session_state.line_index += 1
+def group_test(poem_data):
+    end = st.session_state.line_index
+    line_numbers = list(range(max(0, end - GROUP_SIZE), end))
+    if not line_numbers:
+        # Şiir değiştiğinde ya da ilerleme sıfırlandığında henüz ezberlenmiş satır yoktur
+        st.session_state.group_result = None
+        st.session_state.current_mode = "show"
+        st.info("Grup testi için önce birkaç satır ezberleyin.")
+        st.button("➡️ Devam Et", key="empty_group")
+        return
+
+    st.markdown(f"""
+    <div style="background-color: #f5f5f5; border-radius: 12px; padding: 1.5rem; margin-bottom: 2rem;">
+        <h4 style="color: #4a4a4a; margin-top: 0;">🧩 {line_numbers[0] + 1}-{line_numbers[-1] + 1}. satırları tek seferde ezberden okuyun:</h4>
+        <div style="font-size: 1.2rem; color: #666; font-style: italic;">❓❓❓ (Satırlar gizleniyor)</div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    if st.session_state.get('group_result') is None:
+        spoken_text = recognize_recording('group_job')
+        if spoken_text is None:
+            return
+        index = get_poem_index(st.session_state.selected_poem)
+        st.session_state.group_result = (spoken_text, align_group(index, line_numbers, spoken_text))
+        for result in st.session_state.group_result[1]:
+            record_score(result["line"], 0.0 if result["skipped"] else result["score"])
+
+    spoken_text, results = st.session_state.group_result
+    st.markdown(f"""
+    <div style="background-color: #ffffff; border-radius: 12px; padding: 1.5rem; margin: 1rem 0; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
+        <h4 style="margin-top: 0;">🗣️ Söylediğiniz:</h4>
+        <p style="font-size: 1.1rem;">{spoken_text}</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    rows = []
+    for result in results:
+        line = poem_data["content"][result["line"]]
+        if result["skipped"]:
+            badge = "⏭️ Atlandı"
+        elif result["out_of_order"]:
+            badge = f"🔀 Sıra hatası ({result['score']:.0%})"
+        elif result["score"] >= st.session_state.threshold:
+            badge = f"✅ {result['score']:.0%}"
+        else:
+            badge = f"⚠️ {result['score']:.0%}"
+        rows.append(f"<p><strong>{result['line'] + 1}.</strong> {badge} — <em>{line}</em></p>")
+    passed = all(not r["skipped"] and not r["out_of_order"] and r["score"] >= st.session_state.threshold
+                 for r in results)
+
+    st.markdown(f"""
+    <div class="{'success-box' if passed else 'error-box'}" style="padding: 1.5rem; border-radius: 12px; margin: 1rem 0;">
+        <h4 style="margin-top: 0;">{'✅ Tebrikler! Grubu doğru okudunuz!' if passed else '❌ Bazı satırları tekrar çalışmalısınız'}</h4>
+        {"".join(rows)}
+    </div>
+    """, unsafe_allow_html=True)
+
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        if st.button("🔁 Tekrar Dene", key="retry_group"):
+            st.session_state.group_result = None
+            st.rerun()
+    with col2:
+        if st.button("➡️ Devam Et", key="finish_group", type="primary"):
+            st.session_state.group_result = None
             st.session_state.current_mode = "show"
-            time.sleep(2)
             st.rerun()
-        else:
-            st.markdown(f"""
-            <div class="error-box" style="padding: 1.5rem; border-radius: 12px; margin: 1rem 0;">
-                <h4 style="color: var(--error-color); margin-top: 0;">❌ Tekrar denemeniz gerekiyor</h4>
-                <p>Benzerlik Oranı: <strong>{similarity:.0%}</strong></p>
-                <p>Doğru satır: <em>{current_line}</em></p>
-            </div>
-            """, unsafe_allow_html=True)
 
-            st.button("🔁 Tekrar Dene", key="retry_test", type="primary")
-    except sr.UnknownValueError:
-        st.error("Ses anlaşılamadı. Lütfen daha net ve yakından konuşarak tekrar deneyin.")
-        st.button("🔁 Tekrar Dene", key="retry_unknown")
-    except Exception as e:
-        st.error(f"Bir hata oluştu: {str(e)}")
-    finally:
-        if os.path.exists(wav_file):
-            os.remove(wav_file)
 
+def free_recitation(poem_data):
+    st.markdown("""
+    <div style="background-color: #f5f5f5; border-radius: 12px; padding: 1.5rem; margin-bottom: 2rem;">
+        <h4 style="color: #4a4a4a; margin-top: 0;">🎙️ Serbest Okuma</h4>
+        <div style="font-size: 1.1rem; color: #666;">Ezberlediğiniz herhangi bir bölümü okuyun; söylediğiniz satırları bulacağız.</div>
+    </div>
+    """, unsafe_allow_html=True)
 
-def word_sort_test(poem_data):
-    current_line = poem_data["content"][st.session_state.line_index]
+    scope = st.radio("Arama kapsamı", ["Bu şiir", "Tüm şiirler"], horizontal=True, key="free_scope")
+    if st.button("⬅️ Geri", key="leave_free"):
+        st.session_state.free_job = None
+        st.session_state.current_mode = "show"
+        st.rerun()
 
-    if 'shuffled_words' not in st.session_state or st.session_state.get('current_test_line') != current_line:
-        st.session_state.shuffled_words, st.session_state.correct_words = shuffle_words(current_line)
-        st.session_state.selected_words = []
-        st.session_state.current_test_line = current_line
+    spoken_text = recognize_recording('free_job')
+    if spoken_text is None:
+        return
+
+    st.markdown(f"""
+    <div style="background-color: #ffffff; border-radius: 12px; padding: 1.5rem; margin: 1rem 0; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
+        <h4 style="margin-top: 0;">🗣️ Söylediğiniz:</h4>
+        <p style="font-size: 1.1rem;">{spoken_text}</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    poem_id = poem_data["id"] if scope == "Bu şiir" else None
+    found = locate_spoken_lines(spoken_text, poem_id, st.session_state.threshold)
+    if not found:
+        st.warning("Söylediklerinizle eşleşen bir satır bulunamadı.")
+    else:
+        rows = "".join(
+            f"<p>✅ <strong>{item['title']}</strong> — {item['line'] + 1}. satır ({item['score']:.0%}): <em>{item['text']}</em></p>"
+            for item in found
+        )
+        st.markdown(f"""
+        <div class="success-box" style="padding: 1.5rem; border-radius: 12px; margin: 1rem 0;">
+            <h4 style="color: var(--accent-color); margin-top: 0;">Bulunan satırlar</h4>
+            {rows}
+        </div>
+        """, unsafe_allow_html=True)
+        for item in found:
+            if item["poem_id"] == poem_data["id"]:
+                record_score(item["line"], item["score"])
+
+    st.button("🔁 Tekrar Oku", key="retry_free")
+
+
+def word_sort_test(poem_data):
+    exercises = get_poem_exercises(st.session_state.selected_poem)
+    line_no = st.session_state.line_index
 
     st.markdown(f"""
     <div style="background-color: #f5f5f5; border-radius: 12px; padding: 1.5rem; margin-bottom: 2rem;">
@@ -442,69 +3303,165 @@ def word_sort_test(poem_data):
     </div>
     """, unsafe_allow_html=True)
 
-    st.markdown("### Kelimeleri doğru sıraya dizin (tıklayarak):")
+    st.markdown("### Kelimeleri doğru sıraya dizin (dokunarak ya da sürükleyerek):")
 
-    if st.session_state.selected_words:
-        st.markdown("**Seçtiğiniz sıra:**")
-        selected_text = " ".join([
-                                     f'<span style="display: inline-block; padding: 0.3rem 0.6rem; margin: 0.2rem; background-color: #a5d6a7; border-radius: 12px;">{word}</span>'
-                                     for word in st.session_state.selected_words])
-        st.markdown(selected_text, unsafe_allow_html=True)
+    answer = word_sort_component(
+        words=exercises.scrambled(line_no),
+        key=f"word_sort_{st.session_state.selected_poem}_{st.session_state.line_index}",
+        default=None
+    )
+    if not answer or answer.get("nonce") == st.session_state.get('word_sort_nonce'):
+        return
+    st.session_state.word_sort_nonce = answer["nonce"]
 
-    st.markdown("**Kullanılabilir kelimeler:**")
-    available_words = [w for w in st.session_state.shuffled_words if w not in st.session_state.selected_words]
+    correct_words = exercises.tokens[line_no]
+    correct_answer = " ".join(correct_words)
 
-    cols = st.columns(5)
-    for i, word in enumerate(available_words):
-        col = cols[i % 5]
-        if col.button(word, key=f"available_{word}_{i}"):
-            st.session_state.selected_words.append(word)
-            st.rerun()
+    if exercises.is_correct_order(line_no, answer["order"]):
+        score = min(1.0, 0.7 + (0.3 * (len(answer["order"]) / len(correct_words))))
+        record_score(st.session_state.line_index, score)
+
+        advance_line(f"""
+        <div class="success-box" style="padding: 1rem 1.5rem; border-radius: 12px; margin: 1rem 0;">
+            ✅ Doğru! Harika sıraladınız! Puan: <strong>{score:.0%}</strong>
+        </div>
+        """)
+    else:
+        st.error(f"❌ Yanlış sıra. Doğrusu: {correct_answer}")
+        record_score(st.session_state.line_index, 0.0)
 
-    col1, col2 = st.columns([1, 3])
-    with col1:
-        if st.button("🔄 Sıfırla", key="reset_word_sort"):
-            st.session_state.selected_words = []
-            st.rerun()
-    with col2:
-        if st.button("✅ Kontrol Et", key="check_word_sort", type="primary"):
-            user_answer = " ".join(st.session_state.selected_words)
-            correct_answer = " ".join(st.session_state.correct_words)
-
-            if user_answer == correct_answer:
-                score = min(1.0,
-                            0.7 + (0.3 * (len(st.session_state.selected_words) / len(st.session_state.correct_words))))
-                st.session_state.word_scores[st.session_state.line_index] = score
-
-                st.success(f"✅ Doğru! Harika sıraladınız! Puan: {score:.0%}")
-                st.session_state.completed_lines.append(st.session_state.line_index)
-                st.session_state.line_index += 1
-                st.session_state.current_mode = "show"
-                time.sleep(2)
-                st.rerun()
-            else:
-                st.error(f"❌ Yanlış sıra. Doğrusu: {correct_answer}")
-                st.session_state.word_scores[st.session_state.line_index] = 0.0
+
+def review_card():
+    upcoming = get_scheduler().next_review(st.session_state.user_id)
+    if upcoming is None:
+        return
+
+    due, poem, line_no = upcoming
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("### 🔁 Tekrar Zamanı")
+    remaining = due - time.time()
+    if remaining > 0:
+        if remaining < 3600:
+            when = f"{int(remaining // 60) + 1} dakika sonra"
+        elif remaining < 86400:
+            when = f"{int(remaining // 3600)} saat sonra"
+        else:
+            when = f"{int(remaining // 86400)} gün sonra"
+        st.sidebar.caption(f"Sıradaki tekrar {when}: {poem}, {line_no + 1}. satır")
+        return
+
+    st.sidebar.markdown(f"Tekrar zamanı gelen satır: **{poem}**, {line_no + 1}. satır")
+    st.sidebar.button("▶️ Tekrara Başla", key="start_review", use_container_width=True,
+                      on_click=start_review, args=(poem, line_no))
 
 
 def show_stats():
-    if st.session_state.word_scores:
+    stats = get_score_stats()
+    latest = stats.latest(st.session_state.user_id, st.session_state.selected_poem)
+    if latest.scores:
         st.sidebar.markdown("---")
         st.sidebar.markdown("### 📊 Performans İstatistikleri")
 
-        avg_score = np.mean(list(st.session_state.word_scores.values())) if st.session_state.word_scores else 0
-        st.sidebar.metric("Ortalama Doğruluk", f"{avg_score:.0%}")
+        st.sidebar.metric("Ortalama Doğruluk", f"{latest.mean:.0%}")
+
+        best_line, best_score = latest.best
+        index = get_poem_index(st.session_state.selected_poem)
+        st.sidebar.metric("En İyi Satır",
+                          f"{best_score:.0%}",
+                          help=f"Satır {best_line + 1}: {index.lines[best_line]}")
+
+        attempts = stats.stats("user_poem", st.session_state.user_id, st.session_state.selected_poem)
+        if attempts.count:
+            st.sidebar.metric(f"Son {len(attempts.window)} Deneme", f"{attempts.recent_mean:.0%}",
+                              delta=f"{attempts.recent_mean - attempts.mean:+.0%}",
+                              help=f"Toplam {attempts.count} deneme, ortalama {attempts.mean:.0%}")
+
+
+DASHBOARD_PERIODS = {"Tümü": None, "Son 7 gün": 7, "Son 30 gün": 30}
+TEACHER_KEY = os.environ.get("POETRY_TEACHER_KEY", "")
+
+
+def is_teacher():
+    # Panel tüm öğrencilerin verisini gösterir; yalnızca ?teacher=<POETRY_TEACHER_KEY> ile
+    # açılan oturumlarda kullanılabilir. Anahtar tanımlı değilse panel kapalıdır.
+    key = st.query_params.get("teacher", "")
+    return bool(TEACHER_KEY) and hmac.compare_digest(key.encode(), TEACHER_KEY.encode())
+
 
-        best_line = max(st.session_state.word_scores.items(), key=lambda x: x[1], default=(None, 0))
-        if best_line[0] is not None:
-            poem_data = siirler[st.session_state.selected_poem]
-            st.sidebar.metric("En İyi Satır",
-                              f"{best_line[1]:.0%}",
-                              help=f"Satır {best_line[0] + 1}: {poem_data['content'][best_line[0]]}")
+def teacher_dashboard():
+    st.markdown("## 👩‍🏫 Öğretmen Paneli")
+    stats = get_score_stats()
+    corpus = get_corpus()
+
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        query = st.text_input("🔎 Şiir Ara", key="dashboard_query")
+    with col2:
+        options = corpus.search(query)
+        current = st.session_state.get("dashboard_poem", st.session_state.selected_poem)
+        if current not in options:
+            options = [current] + options
+        poem = st.selectbox("Şiir", options, key="dashboard_poem", index=options.index(current))
+    with col3:
+        period = st.selectbox("Dönem", list(DASHBOARD_PERIODS), key="dashboard_period")
+    days = DASHBOARD_PERIODS[period]
+    since = time.time() - days * 86400 if days else None
+
+    summary = stats.summary(poem, since)
+    if not summary["attempts"]:
+        st.info("Bu şiir için henüz deneme kaydı yok.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Deneme", summary["attempts"])
+    col2.metric("Öğrenci", summary["users"])
+    col3.metric("Ortalama Skor", f"{summary['mean']:.0%}")
+
+    st.markdown("### 🧗 En Zor Satırlar")
+    lines = load_poem(poem)["content"]
+    hardest = stats.hardest_lines(poem, since)
+    if hardest:
+        st.dataframe({
+            "Satır": [row["line"] + 1 for row in hardest],
+            "Metin": [lines[row["line"]] for row in hardest],
+            "Deneme": [row["attempts"] for row in hardest],
+            "Ortalama": [f"{row['mean']:.0%}" for row in hardest],
+            "Sapma": [f"{row['std']:.2f}" for row in hardest],
+            "Başarısız": [f"{row['fail_rate']:.0%}" for row in hardest],
+            "Süre (sn)": [round(row["latency"], 1) for row in hardest],
+        }, use_container_width=True, hide_index=True)
+    else:
+        st.caption(f"En az {HARD_LINE_MIN_ATTEMPTS} deneme yapılan satır yok.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("### 📈 Skor Dağılımı")
+        st.bar_chart({
+            "Aralık": [f"{i * 100 // SCORE_BINS}-{(i + 1) * 100 // SCORE_BINS}%" for i in range(SCORE_BINS)],
+            "Deneme": summary["histogram"],
+        }, x="Aralık", y="Deneme")
+    with col2:
+        st.markdown("### 🎯 Alıştırma Türleri")
+        modes = stats.by_mode(poem, since)
+        st.dataframe({
+            "Tür": [row["mode"] for row in modes],
+            "Deneme": [row["attempts"] for row in modes],
+            "Ortalama": [f"{row['mean']:.0%}" for row in modes],
+            "Süre (sn)": [round(row["latency"], 1) for row in modes],
+        }, use_container_width=True, hide_index=True)
 
 
 # --- Ana Uygulama ---
 def main():
+    with METRICS.trace(mode=st.session_state.current_mode):
+        practice_page()
+    if IMPORT_REPORT or "debug" in st.query_params:
+        # Sayfa gövdesinden sonra çizilir; gövdenin tetiklediği yüklemeler de listede olur
+        with st.sidebar.expander("⏱️ Yükleme süreleri"):
+            st.text("\n".join(import_report()))
+
+
+def practice_page():
     st.markdown("""
     <div style="text-align: center; margin-bottom: 2rem;">
         <h1 style="color: #4a4a4a; margin-bottom: 0.5rem;">📖 PoetryMaster Pro</h1>
@@ -512,7 +3469,7 @@ def main():
     </div>
     """, unsafe_allow_html=True)
 
-    with st.sidebar:
+    with st.sidebar, METRICS.span("sidebar"):
         st.markdown("""
         <div style="text-align: center; margin-bottom: 1.5rem;">
             <h3 style="color: #4a4a4a;">⚙️ Ayarlar</h3>
@@ -538,35 +3495,61 @@ def main():
             help="Sesli okuma ve ses tanıma özelliklerini etkinleştirir"
         )
 
+        st.session_state.streaming_mode = st.checkbox(
+            "⚡ Canlı değerlendirme",
+            value=st.session_state.streaming_mode,
+            help="Siz okurken satırı değerlendirir, doğru okuduğunuz anda testi bitirir"
+        )
+
         st.markdown("---")
         user_profile_card()
         poem_selection_card()
+        persist_progress()
+        hydrate_progress()
         show_stats()
+        review_card()
+
+        if is_teacher():
+            st.checkbox("👩‍🏫 Öğretmen Paneli", key="teacher_view",
+                        help="Tüm öğrencilerin denemelerinden şiir ve satır istatistikleri")
 
         if st.button("🔄 Oturumu Sıfırla", use_container_width=True):
-            st.session_state.clear()
-            init_session()
+            reset_session()
             st.rerun()
 
-    poem_data = siirler[st.session_state.selected_poem]
+    if st.session_state.get('teacher_view') and is_teacher():
+        with METRICS.span("teacher_dashboard"):
+            teacher_dashboard()
+        return
 
-    st.markdown(f"""
-    <div style="background-color: {poem_data['bg_color']}; border-radius: 12px; padding: 1.5rem; margin-bottom: 1.5rem;">
-        <div style="display: flex; justify-content: space-between; align-items: center;">
-            <div>
-                <h2 style="margin-top: 0; color: #333;">{st.session_state.selected_poem}</h2>
-                <p style="margin-bottom: 0; font-size: 1.1rem; color: #555;">Şair: {poem_data['author']}</p>
-            </div>
-            <div style="font-size: 1.2rem; background-color: rgba(255,255,255,0.7); padding: 0.5rem 1rem; border-radius: 20px;">
-                {st.session_state.line_index + 1}/{len(poem_data['content'])}. Satır
+    if st.session_state.get('timed_mode') != st.session_state.current_mode:
+        # Deneme süresi, alıştırmaya girildiği andan skorun kaydedildiği ana kadar ölçülür
+        st.session_state.timed_mode = st.session_state.current_mode
+        st.session_state.mode_started = time.time()
+
+    with METRICS.span("header"):
+        poem_data = load_poem(st.session_state.selected_poem)
+
+        st.markdown(f"""
+        <div style="background-color: {poem_data['bg_color']}; border-radius: 12px; padding: 1.5rem; margin-bottom: 1.5rem;">
+            <div style="display: flex; justify-content: space-between; align-items: center;">
+                <div>
+                    <h2 style="margin-top: 0; color: #333;">{st.session_state.selected_poem}</h2>
+                    <p style="margin-bottom: 0; font-size: 1.1rem; color: #555;">Şair: {poem_data['author']}</p>
+                </div>
+                <div style="font-size: 1.2rem; background-color: rgba(255,255,255,0.7); padding: 0.5rem 1rem; border-radius: 20px;">
+                    {active_line() + 1}/{len(poem_data['content'])}. Satır
+                </div>
             </div>
         </div>
-    </div>
-    """, unsafe_allow_html=True)
+        """, unsafe_allow_html=True)
 
-    progress_tracker()
+        progress_tracker()
+        show_flash()
 
-    if st.session_state.line_index >= len(poem_data["content"]):
+    if st.session_state.current_mode != "test":
+        st.session_state.review_line = None
+    if st.session_state.get('review_line') is None and st.session_state.line_index >= len(poem_data["content"]):
         st.balloons()
         st.success("🎉 Tebrikler! Bu şiiri başarıyla tamamladınız!")
         if st.button("Başka bir şiir seç"):
@@ -575,16 +3558,17 @@ def main():
             st.rerun()
         return
 
-    if st.session_state.current_mode == "show":
-        show_line(poem_data)
-    elif st.session_state.current_mode == "test":
-        test_line(poem_data)
-    elif st.session_state.current_mode == "word_sort":
-        word_sort_test(poem_data)
-    elif st.session_state.current_mode == "group_test":
-        st.warning("Grup testi özelliği yakında eklenecek!")
-        st.session_state.current_mode = "show"
-        st.rerun()
+    with METRICS.span("mode", mode=st.session_state.current_mode):
+        if st.session_state.current_mode == "show":
+            show_line(poem_data)
+        elif st.session_state.current_mode == "test":
+            test_line(poem_data)
+        elif st.session_state.current_mode == "word_sort":
+            word_sort_test(poem_data)
+        elif st.session_state.current_mode == "group_test":
+            group_test(poem_data)
+        elif st.session_state.current_mode == "free":
+            free_recitation(poem_data)
 
 
 if __name__ == "__main__":